@@ -0,0 +1,237 @@
+# batch_images.py
+"""
+Describe o analiza carpetas enteras de imágenes sin Streamlit.
+
+    python batch_images.py fotos/ -o descripciones.jsonl --workers 8 --rate 4
+    python batch_images.py manifiesto.txt -o analisis.jsonl --task analyze --prompt "¿Qué producto es?"
+
+La entrada es un directorio (se recorre entero) o un manifiesto: un .txt con una
+ruta por línea o un .jsonl con un campo "path". Los resultados se escriben línea
+a línea en el JSONL de salida, que hace también de punto de control: si el
+proceso se corta, al relanzarlo con la misma salida se saltan las imágenes ya hechas.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+EXTENSIONES = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+WORKERS = int(os.environ.get("HEX_BATCH_WORKERS", "8"))
+# Peticiones por segundo a la Inference API entre todos los hilos
+RATE = float(os.environ.get("HEX_BATCH_RATE", "4"))
+MAX_RETRIES = 3
+REPORT_EVERY = 30.0
+
+
+def listar_imagenes(entrada: str):
+    """Rutas de las imágenes de un directorio o de un manifiesto, en orden estable."""
+    if os.path.isdir(entrada):
+        for raiz, dirs, archivos in os.walk(entrada):
+            dirs.sort()
+            for nombre in sorted(archivos):
+                if os.path.splitext(nombre)[1].lower() in EXTENSIONES:
+                    yield os.path.join(raiz, nombre)
+        return
+    base = os.path.dirname(os.path.abspath(entrada))
+    with open(entrada, encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.strip()
+            if not linea or linea.startswith("#"):
+                continue
+            ruta = json.loads(linea)["path"] if entrada.endswith(".jsonl") else linea
+            yield ruta if os.path.isabs(ruta) else os.path.join(base, ruta)
+
+
+def ya_procesadas(salida: str, reintentar_errores: bool = False) -> set:
+    """Rutas que ya están en el JSONL de salida (las fallidas solo si no se reintentan)."""
+    hechas = set()
+    if not os.path.exists(salida):
+        return hechas
+    with open(salida, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+            except ValueError:
+                continue  # última línea a medio escribir por un corte
+            if registro.get("status") == "ok" or not reintentar_errores:
+                hechas.add(registro["path"])
+    return hechas
+
+
+def es_transitorio(error: Exception) -> bool:
+    """
+    Vale la pena reintentar: errores de red, timeouts y respuestas 429/5xx. Un
+    4xx, una imagen que no se puede abrir o una respuesta mal formada fallan igual
+    la segunda vez, así que se registran como error al momento.
+    """
+    import requests
+
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError, ConnectionError, TimeoutError))
+
+
+class RateLimiter:
+    """Cubeta de fichas compartida: como mucho `rate` llamadas por segundo, con ráfagas de `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.rate
+            time.sleep(espera)
+
+
+class BatchRunner:
+    """
+    Procesa imágenes con un número fijo de hilos, respetando el límite de
+    peticiones, reintentando los fallos y escribiendo cada resultado al terminar.
+    """
+
+    def __init__(self, token: str, task: str = "caption", prompt: str = None, workers: int = WORKERS,
+                 rate: float = RATE, max_retries: int = MAX_RETRIES):
+        self.token = token
+        self.task = task
+        self.prompt = prompt or "Describe la imagen"
+        self.workers = workers
+        self.limiter = RateLimiter(rate, burst=max(1, workers // 2))
+        self.max_retries = max_retries
+        self._write_lock = threading.Lock()
+        self.counters = {"ok": 0, "error": 0, "skipped": 0, "retries": 0, "bytes_read": 0}
+        self._start = None
+
+    def _llamadas(self, image_bytes: bytes) -> dict:
+        resultado = {}
+        if self.task in ("caption", "both"):
+            from blip_helper import describir_imagen
+            self.limiter.acquire()
+            resultado["caption"] = describir_imagen(image_bytes, self.token)
+        if self.task in ("analyze", "both"):
+            from vision_helper import analizar_imagen_con_llava
+            self.limiter.acquire()
+            resultado["analysis"] = analizar_imagen_con_llava(image_bytes, self.prompt)
+        return resultado
+
+    def procesar(self, ruta: str) -> dict:
+        registro = {"path": ruta, "task": self.task}
+        start = time.perf_counter()
+        reintentos = 0
+        with metrics.span("batch_image") as span:
+            try:
+                with open(ruta, "rb") as f:
+                    image_bytes = f.read()
+                registro["bytes"] = len(image_bytes)
+                for intento in range(self.max_retries + 1):
+                    try:
+                        registro.update(self._llamadas(image_bytes))
+                        registro["status"] = "ok"
+                        break
+                    except Exception as e:
+                        # Solo los fallos pasajeros se reintentan, con espera creciente
+                        if intento == self.max_retries or not es_transitorio(e):
+                            raise
+                        reintentos += 1
+                        time.sleep(min(30, 2 ** intento))
+            except Exception as e:
+                span.status = "error"
+                registro.update(status="error", error=f"{type(e).__name__}: {e}")
+            # Los 503 que reintentó hf_transport también cuentan
+            reintentos += span.retries
+        registro.update(retries=reintentos, seconds=round(time.perf_counter() - start, 3))
+        return registro
+
+    def run(self, rutas, salida: str, reintentar_errores: bool = False, report_every: float = REPORT_EVERY) -> dict:
+        hechas = ya_procesadas(salida, reintentar_errores)
+        self._start = time.perf_counter()
+        fin = threading.Event()
+
+        def reportero():
+            while not fin.wait(report_every):
+                self.reportar()
+        threading.Thread(target=reportero, name="hex-batch-report", daemon=True).start()
+        # Cola acotada: no se crean 50k futures de golpe
+        cupo = threading.BoundedSemaphore(self.workers * 2)
+
+        with open(salida, "a", encoding="utf-8") as out, ThreadPoolExecutor(self.workers, thread_name_prefix="hex-batch") as pool:
+            def terminar(future):
+                registro = future.result()
+                with self._write_lock:
+                    out.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                    out.flush()
+                    self.counters[registro["status"]] += 1
+                    self.counters["retries"] += registro["retries"]
+                    self.counters["bytes_read"] += registro.get("bytes", 0)
+                cupo.release()
+
+            for ruta in rutas:
+                if ruta in hechas:
+                    self.counters["skipped"] += 1
+                    continue
+                cupo.acquire()
+                pool.submit(self.procesar, ruta).add_done_callback(terminar)
+        fin.set()
+        resumen = self.stats()
+        self.reportar()
+        return resumen
+
+    def stats(self) -> dict:
+        with self._write_lock:
+            elapsed = time.perf_counter() - self._start if self._start else 0.0
+            hechas = self.counters["ok"] + self.counters["error"]
+            return dict(self.counters, seconds=round(elapsed, 1),
+                        images_per_min=hechas / elapsed * 60 if elapsed else 0.0)
+
+    def reportar(self):
+        s = self.stats()
+        print(f"[lote] {s['ok']} ok, {s['error']} errores, {s['skipped']} ya hechas, "
+              f"{s['retries']} reintentos, {s['images_per_min']:.1f} imágenes/min", flush=True)
+
+
+def procesar_lote(entrada: str, salida: str, token: str, task: str = "caption", prompt: str = None,
+                  workers: int = WORKERS, rate: float = RATE, reintentar_errores: bool = False) -> dict:
+    """Punto de entrada como librería; devuelve el resumen (ok, errores, reintentos, imágenes/min)."""
+    runner = BatchRunner(token, task=task, prompt=prompt, workers=workers, rate=rate)
+    return runner.run(listar_imagenes(entrada), salida, reintentar_errores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("entrada", help="directorio de imágenes o manifiesto (.txt / .jsonl)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL de resultados (y punto de control)")
+    parser.add_argument("--task", choices=["caption", "analyze", "both"], default="caption")
+    parser.add_argument("--prompt", help="pregunta para el análisis con LLaVA")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--rate", type=float, default=RATE, help="peticiones por segundo (0 = sin límite)")
+    parser.add_argument("--retry-errors", action="store_true", help="vuelve a intentar las que fallaron antes")
+    parser.add_argument("--token", default=os.environ.get("HUGGINGFACE_API_TOKEN") or os.environ.get("HF_TOKEN"))
+    args = parser.parse_args()
+
+    resumen = procesar_lote(args.entrada, args.output, args.token, args.task, args.prompt,
+                            args.workers, args.rate, args.retry_errors)
+    print(json.dumps(resumen, indent=2))
+    if resumen["error"]:
+        raise SystemExit(f"{resumen['error']} imágenes fallaron; relanza con --retry-errors para reintentarlas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# benchmarks/bench_load.py
+"""
+Prueba de carga sin red: arranca el servidor de prueba de la Inference API,
+abre N sesiones de streamlit_app.py con AppTest en paralelo y mide la latencia
+de cada turno, el tiempo de rerun y la memoria por sesión. Los resultados van
+a un JSON para comparar entre commits.
+
+    python -m benchmarks.bench_load --sessions 8 --turns 5 --json carga.json
+    python -m benchmarks.bench_load --chat-latency lognormal:0.5:0.6 --loading-rate 0.1
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from benchmarks.stub_server import add_arguments, config_from_args, iniciar
+
+# AppTest resuelve las rutas relativas desde el archivo que lo llama, no desde el cwd
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+# Lo que contesta el chat del servidor de prueba; un mensaje de error no cuenta como respuesta
+RESPUESTA_STUB = "palabra0 "
+
+
+def percentiles(valores: list) -> dict:
+    if not valores:
+        return {}
+    ordenados = sorted(valores)
+
+    def p(q):
+        return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+    return {"n": len(ordenados), "mean": statistics.fmean(ordenados),
+            "p50": p(0.5), "p95": p(0.95), "p99": p(0.99), "max": ordenados[-1]}
+
+
+def rss_mb() -> float:
+    # RSS actual en Linux; en otros sistemas, el máximo que reporta getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 2 ** 20 if sys.platform == "darwin" else maxrss / 1024
+
+
+def commit_actual() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _fallo(at, etapa, resultados) -> bool:
+    """Anota las excepciones que la app mostró en la última ejecución."""
+    for error in at.exception:
+        resultados["errors"].append(f"{etapa}: {error.value}")
+    return bool(at.exception)
+
+
+def sesion(i, args, barrera, resultados):
+    from streamlit.testing.v1 import AppTest
+    from image_jobs import job_queue, DONE, PENDING
+
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    at.query_params["u"] = f"bench-{os.getpid()}-{i}"
+    barrera.wait()
+    start = time.perf_counter()
+    at.run()
+    resultados["first_render"].append(time.perf_counter() - start)
+    _fallo(at, f"sesión {i}, primer render", resultados)
+
+    for turno in range(args.turns):
+        imagen = args.image_every and turno % args.image_every == args.image_every - 1
+        at.session_state["modo_generacion"] = "imagen" if imagen else "texto"
+        prompt = f"Sesión {i}, turno {turno}: explícame algo distinto cada vez"
+        start = time.perf_counter()
+        at.chat_input(key="chat_input").set_value(prompt).run()
+        resultados["turn"].append(time.perf_counter() - start)
+        if _fallo(at, f"sesión {i}, turno {turno}", resultados):
+            continue
+        ultimo = at.session_state["active_messages"][-1] if at.session_state["active_messages"] else {}
+        if imagen:
+            job = job_queue.get(ultimo["job_id"]) if ultimo.get("job_id") else None
+            while job is not None and job.status in PENDING:
+                time.sleep(0.05)
+            if job is not None and job.finished_at:
+                resultados["image"].append(job.finished_at - job.submitted_at)
+            if job is not None and job.status == DONE:
+                resultados["answered"].append(turno)
+        elif ultimo.get("role") == "assistant" and RESPUESTA_STUB in (ultimo.get("content") or ""):
+            resultados["answered"].append(turno)
+
+        # Un rerun sin entrada: lo que cuesta cualquier interacción con el historial ya cargado
+        start = time.perf_counter()
+        at.run()
+        resultados["rerun"].append(time.perf_counter() - start)
+        _fallo(at, f"sesión {i}, rerun {turno}", resultados)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--image-every", type=int, default=0, help="cada cuántos turnos se pide una imagen (0 = nunca)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", default="bench_load.json", help="archivo donde guardar los resultados")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_args(args)
+    server, url = iniciar(config)
+    # Todo lo que la app guarda va a un directorio temporal, y nada sale a la red
+    tmp = tempfile.mkdtemp(prefix="hex_bench_")
+    os.environ.update({
+        "HF_INFERENCE_BASE": url,
+        "HEX_CHAT_DB": os.path.join(tmp, "chats.db"),
+        "HEX_BLOB_DIR": os.path.join(tmp, "blobs"),
+        "HEX_IMAGE_CACHE_DIR": os.path.join(tmp, "image_cache"),
+        "HEX_WARMUP": "0",
+        "HEX_METRICS_PORT": "0",
+        # Las descargas del Hub (el tokenizador) también van al servidor de prueba, que
+        # responde 404. HF_HUB_OFFLINE no sirve: bloquea también las llamadas de inferencia
+        "HF_ENDPOINT": url,
+    })
+
+    # Los secretos van una sola vez al st.secrets global: AppTest.secrets lo cambia y
+    # lo restaura en cada run, y con sesiones en paralelo una deja a otra sin ellos
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+    st.secrets = Secrets()
+    st.secrets._secrets = {"HUGGINGFACE_API_TOKEN": "bench"}
+    # Cada run de AppTest compila el script con su propia caché; compilar en varios
+    # hilos a la vez rompe CPython 3.11 ("AST constructor recursion depth mismatch")
+    # y el run termina vacío, sin excepción visible
+    from streamlit.runtime.scriptrunner import script_cache
+    compilar = script_cache.ScriptCache.get_bytecode
+    compilando = threading.Lock()
+
+    def get_bytecode(self, script_path):
+        with compilando:
+            return compilar(self, script_path)
+    script_cache.ScriptCache.get_bytecode = get_bytecode
+
+    resultados = {"first_render": [], "turn": [], "rerun": [], "image": [], "answered": [], "errors": []}
+    barrera = threading.Barrier(args.sessions)
+    rss_inicio = rss_mb()
+    hilos = []
+
+    def correr(i):
+        try:
+            sesion(i, args, barrera, resultados)
+        except Exception:
+            resultados["errors"].append(traceback.format_exc(limit=3))
+            barrera.abort()
+
+    start = time.perf_counter()
+    for i in range(args.sessions):
+        hilo = threading.Thread(target=correr, args=(i,), name=f"bench-session-{i}")
+        hilo.start()
+        hilos.append(hilo)
+    for hilo in hilos:
+        hilo.join()
+    total = time.perf_counter() - start
+    rss_fin = rss_mb()
+    server.shutdown()
+
+    reporte = {
+        "commit": commit_actual(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "wall_seconds": total,
+        "turns_answered": len(resultados["answered"]),
+        "turns_total": args.sessions * args.turns,
+        "turns_per_second": len(resultados["answered"]) / total if total else 0.0,
+        "first_render_s": percentiles(resultados["first_render"]),
+        "turn_latency_s": percentiles(resultados["turn"]),
+        "rerun_s": percentiles(resultados["rerun"]),
+        "image_latency_s": percentiles(resultados["image"]),
+        "rss_mb": {"start": rss_inicio, "end": rss_fin,
+                   "per_session": (rss_fin - rss_inicio) / args.sessions},
+        "stub_requests": dict(config.requests),
+        "errors": resultados["errors"][:20],
+    }
+    with open(args.json, "w") as f:
+        json.dump(reporte, f, indent=2)
+
+    for nombre in ("turn_latency_s", "rerun_s", "image_latency_s"):
+        p = reporte[nombre]
+        if p:
+            print(f"{nombre:>16}: p50={p['p50'] * 1000:.0f} ms  p95={p['p95'] * 1000:.0f} ms  p99={p['p99'] * 1000:.0f} ms")
+    print(f"{'turnos':>16}: {reporte['turns_answered']} de {reporte['turns_total']} respondidos")
+    print(f"{'memoria':>16}: {reporte['rss_mb']['per_session']:.1f} MB por sesión")
+    print(f"Resultados en {args.json}")
+    if resultados["errors"]:
+        raise SystemExit(f"{len(resultados['errors'])} errores durante la carga; ver {args.json}")
+    if reporte["turns_answered"] < reporte["turns_total"]:
+        raise SystemExit(f"{reporte['turns_total'] - reporte['turns_answered']} turnos sin respuesta; ver {args.json}")
+
+
+if __name__ == "__main__":
+    main()
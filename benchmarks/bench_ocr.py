@@ -0,0 +1,94 @@
+# benchmarks/bench_ocr.py
+"""
+Compara líneas por segundo del OCR local (TrOCR fp32 e int8) contra el
+análisis remoto con LLaVA.
+
+    python -m benchmarks.bench_ocr --lines 32 --threads 4
+    python -m benchmarks.bench_ocr --images fotos/ --remote   # requiere HF_TOKEN
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import time
+
+
+def _lineas_sinteticas(n):
+    from PIL import Image, ImageDraw
+    lineas = []
+    for i in range(n):
+        image = Image.new("RGB", (640, 48), "white")
+        ImageDraw.Draw(image).text((10, 14), f"Linea {i}: el zorro marron salta sobre el perro", fill="black")
+        lineas.append(image)
+    return lineas
+
+
+def _lineas_de_carpeta(carpeta):
+    from PIL import Image
+    from ocr_engine import segmentar_lineas
+    lineas = []
+    for nombre in sorted(os.listdir(carpeta)):
+        if nombre.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
+            lineas.extend(segmentar_lineas(Image.open(os.path.join(carpeta, nombre)).convert("RGB")))
+    return lineas
+
+
+def medir_local(lineas, quantized, threads, batch_size):
+    from ocr_engine import OCREngine
+    engine = OCREngine(quantized=quantized, threads=threads, batch_size=batch_size)
+    engine.transcribir_lineas(lineas[:batch_size])  # calentamiento y carga del modelo
+    stats = {}
+    engine.transcribir_lineas(lineas, stats)
+    return stats
+
+
+def medir_remoto(lineas):
+    import hf_transport
+    client = hf_transport.get_inference_client("llava-hf/llava-1.6-mistral-7b-hf", token=os.environ.get("HF_TOKEN"))
+    start = time.perf_counter()
+    for linea in lineas:
+        buffer = io.BytesIO()
+        linea.save(buffer, format="PNG")
+        imagen = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+        client.chat_completion(messages=[{"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": imagen}},
+            {"type": "text", "text": "Transcribe el texto manuscrito"},
+        ]}], max_tokens=64)
+    elapsed = time.perf_counter() - start
+    return {"lines": len(lineas), "seconds": elapsed, "lines_per_s": len(lineas) / elapsed, "model": "llava (remoto)"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=32, help="líneas sintéticas si no se pasa --images")
+    parser.add_argument("--images", help="carpeta con páginas reales")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--remote", action="store_true", help="incluye el camino remoto (lento, consume cuota)")
+    parser.add_argument("--json", help="archivo donde guardar los resultados")
+    args = parser.parse_args()
+
+    from ocr_engine import OCR_THREADS
+    threads = args.threads or OCR_THREADS
+    lineas = _lineas_de_carpeta(args.images) if args.images else _lineas_sinteticas(args.lines)
+
+    resultados = [
+        medir_local(lineas, False, threads, args.batch_size),
+        medir_local(lineas, True, threads, args.batch_size),
+    ]
+    if args.remote:
+        resultados.append(medir_remoto(lineas[:8]))
+
+    print(f"{len(lineas)} líneas, {threads} hilos, lotes de {args.batch_size}")
+    print(f"{'modelo':<16} {'líneas/s':>9} {'segundos':>9} {'MB':>7}")
+    for r in resultados:
+        mb = r.get("resident_bytes", 0) / 1024 ** 2
+        print(f"{r['model']:<16} {r['lines_per_s']:>9.2f} {r['seconds']:>9.2f} {mb:>7.0f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
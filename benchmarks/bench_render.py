@@ -0,0 +1,79 @@
+# benchmarks/bench_render.py
+"""
+Mide el tiempo de un rerun de streamlit_app.py según el largo del historial,
+con la ventana de mensajes activada y desactivada.
+
+    python -m benchmarks.bench_render --sizes 10 100 1000 --images-every 10
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import time
+
+from streamlit.testing.v1 import AppTest
+
+# AppTest resuelve las rutas relativas desde el archivo que lo llama, no desde el cwd
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+def _imagen_demo(i):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (1024, 1024), (i * 37 % 255, 80, 160)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _historial(n, images_every):
+    from blob_store import blob_store
+    messages = []
+    for i in range(n):
+        role = "user" if i % 2 == 0 else "assistant"
+        message = {"id": f"m{i}", "role": role, "content": f"Mensaje {i} " + "texto " * 40}
+        if images_every and i % images_every == images_every - 1:
+            message["image_hash"] = blob_store.put(_imagen_demo(i))
+        messages.append(message)
+    # El último mensaje es del asistente para que el rerun no llame a la API
+    messages[-1]["role"] = "assistant"
+    return messages
+
+
+def medir(n, ventana, images_every, repeticiones):
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.secrets["HUGGINGFACE_API_TOKEN"] = "bench"
+    at.session_state["active_messages"] = _historial(n, images_every)
+    at.session_state["active_chat_id"] = "bench"
+    at.session_state["ventana_chat"] = ventana or n
+    at.run()  # primera ejecución: imports y miniaturas
+    tiempos = []
+    for _ in range(repeticiones):
+        start = time.perf_counter()
+        at.run()
+        tiempos.append(time.perf_counter() - start)
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500, 1000])
+    parser.add_argument("--images-every", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--window", type=int, default=30, help="igual a CHAT_WINDOW en streamlit_app.py")
+    parser.add_argument("--json", help="archivo donde guardar los resultados")
+    args = parser.parse_args()
+
+    resultados = []
+    print(f"{'mensajes':>9} {'completo (ms)':>14} {'ventana (ms)':>13}")
+    for n in args.sizes:
+        completo = medir(n, None, args.images_every, args.repeat)
+        ventana = medir(n, args.window, args.images_every, args.repeat)
+        resultados.append({"messages": n, "full_ms": completo * 1000, "windowed_ms": ventana * 1000})
+        print(f"{n:>9} {completo * 1000:>14.1f} {ventana * 1000:>13.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_startup.py
+"""
+Mide el arranque en frío de streamlit_app.py en un proceso nuevo: tiempo de
+import por módulo (al estilo `python -X importtime`) y tiempo hasta el primer
+render con AppTest. Sirve de guardia de regresión:
+
+    python -m benchmarks.bench_startup --max-first-render 3 --top 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Módulos que no deberían cargarse para pintar la página
+HEAVY_MODULES = ("torch", "transformers", "PIL")
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("streamlit_app.py", default_timeout=120)
+at.secrets["HUGGINGFACE_API_TOKEN"] = "bench"
+at.run()
+elapsed = time.perf_counter() - start
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({"first_render_s": elapsed, "heavy_loaded": heavy, "exceptions": [str(e.value) for e in at.exception]}))
+"""
+
+
+def parse_importtime(stderr: str):
+    """{módulo de primer nivel: ms acumulados} a partir de la salida de -X importtime."""
+    tiempos = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # cabecera
+        # Los submódulos van indentados; solo contamos los de primer nivel
+        if name.startswith("  "):
+            continue
+        tiempos[name.strip()] = tiempos.get(name.strip(), 0) + int(cumulative) / 1000
+    return tiempos
+
+
+def medir():
+    # Sin precalentamiento: su hilo cargaría transformers mientras medimos
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SCRIPT % (HEAVY_MODULES,)],
+        capture_output=True, text=True, env={**os.environ, "HEX_WARMUP": "0"},
+    )
+    if proc.returncode != 0:
+        raise SystemExit(proc.stderr[-2000:])
+    resultado = json.loads(proc.stdout.strip().splitlines()[-1])
+    resultado["imports_ms"] = parse_importtime(proc.stderr)
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-first-render", type=float, help="falla si el primer render tarda más (s)")
+    parser.add_argument("--json", help="archivo donde guardar los resultados")
+    args = parser.parse_args()
+
+    resultado = medir()
+    print(f"Primer render: {resultado['first_render_s']:.2f}s")
+    print(f"{'módulo':<40} {'ms':>9}")
+    for nombre, ms in sorted(resultado["imports_ms"].items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"{nombre:<40} {ms:>9.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resultado, f, indent=2)
+
+    errores = []
+    if resultado["exceptions"]:
+        errores.append(f"la app lanzó excepciones: {resultado['exceptions']}")
+    if resultado["heavy_loaded"]:
+        errores.append(f"módulos pesados cargados en el arranque: {resultado['heavy_loaded']}")
+    if args.max_first_render and resultado["first_render_s"] > args.max_first_render:
+        errores.append(f"primer render {resultado['first_render_s']:.2f}s > {args.max_first_render}s")
+    if errores:
+        raise SystemExit("REGRESIÓN: " + "; ".join(errores))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# benchmarks/stub_server.py
+"""
+Servidor local que imita los endpoints de la Inference API que usa la app:
+chat completion (con y sin streaming), imágenes de FLUX/SD, descripciones de
+imagen en JSON y respuestas 503 de "modelo cargando", con latencias configurables.
+
+    python -m benchmarks.stub_server --port 8765 --chat-latency lognormal:0.4:0.5
+    HF_INFERENCE_BASE=http://localhost:8765 streamlit run streamlit_app.py
+"""
+import argparse
+import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Latency:
+    """
+    Distribución de latencias en segundos: "0.5" (fija), "uniform:0.2:1.0"
+    o "lognormal:mediana:sigma".
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        partes = spec.split(":")
+        self.kind = partes[0] if len(partes) > 1 else "fixed"
+        self.args = [float(x) for x in (partes[1:] if len(partes) > 1 else partes)]
+
+    def sample(self) -> float:
+        if self.kind == "uniform":
+            return random.uniform(*self.args)
+        if self.kind == "lognormal":
+            mediana, sigma = self.args
+            return random.lognormvariate(math.log(mediana), sigma)
+        return self.args[0]
+
+    def __repr__(self):
+        return self.spec
+
+
+def png_solido(size: int, color=(90, 140, 200)) -> bytes:
+    """PNG de un solo color sin depender de PIL."""
+    def chunk(tipo, datos):
+        return struct.pack(">I", len(datos)) + tipo + datos + struct.pack(">I", zlib.crc32(tipo + datos) & 0xFFFFFFFF)
+    fila = b"\x00" + bytes(color) * size
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(fila * size, 6))
+            + chunk(b"IEND", b""))
+
+
+class StubConfig:
+    def __init__(self, chat_latency="0.3", token_interval=0.02, tokens=60, image_latency="2.0",
+                 caption_latency="0.3", loading_rate=0.0, image_px=512):
+        self.chat_latency = Latency(chat_latency)
+        self.image_latency = Latency(image_latency)
+        self.caption_latency = Latency(caption_latency)
+        self.token_interval = token_interval
+        self.tokens = tokens
+        self.loading_rate = loading_rate
+        self.image = png_solido(image_px)
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def count(self, route: str):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = None
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        # Los clientes cierran conexiones keep-alive cuando quieren; no es un error
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def do_GET(self):
+        # Descargas del Hub (p. ej. el tokenizador): no hay nada que servir
+        self.config.count("hub")
+        self.send_error(404)
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+        path = self.path.split("?")[0]
+        if not path.startswith("/models/"):
+            self._json(404, {"error": "not found"})
+            return
+        if self.config.loading_rate and random.random() < self.config.loading_rate:
+            self.config.count("503")
+            self._json(503, {"error": "Model is currently loading", "estimated_time": 0.2})
+            return
+        if path.endswith("/v1/chat/completions"):
+            self._chat(json.loads(body or b"{}"))
+        elif "FLUX" in path or "stable-diffusion" in path:
+            self.config.count("image")
+            time.sleep(self.config.image_latency.sample())
+            self._send(200, "image/png", self.config.image)
+        else:
+            self.config.count("caption")
+            time.sleep(self.config.caption_latency.sample())
+            self._json(200, [{"generated_text": "una imagen de prueba con un fondo azul"}])
+
+    def _chat(self, payload):
+        stream = payload.get("stream", False)
+        self.config.count("chat_stream" if stream else "chat")
+        time.sleep(self.config.chat_latency.sample())
+        palabras = [f"palabra{i} " for i in range(self.config.tokens)]
+        base = {"id": uuid.uuid4().hex, "created": int(time.time()), "model": payload.get("model", "stub"),
+                "system_fingerprint": "stub"}
+        if not stream:
+            self._json(200, dict(base, object="chat.completion", choices=[
+                {"index": 0, "message": {"role": "assistant", "content": "".join(palabras)}, "finish_reason": "stop"}],
+                usage={"prompt_tokens": 0, "completion_tokens": len(palabras), "total_tokens": len(palabras)}))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, palabra in enumerate(palabras):
+            chunk = dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": {"role": "assistant", "content": palabra},
+                 "finish_reason": "stop" if i == len(palabras) - 1 else None}])
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            time.sleep(self.config.token_interval)
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, status, obj):
+        self._send(status, "application/json", json.dumps(obj).encode())
+
+    def _send(self, status, content_type, data):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def iniciar(config: StubConfig, port: int = 0):
+    """Arranca el servidor en un hilo y devuelve (servidor, url base)."""
+    handler = type("Handler", (_Handler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="hex-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def add_arguments(parser):
+    parser.add_argument("--chat-latency", default="0.3", help="hasta el primer token")
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--image-latency", default="2.0")
+    parser.add_argument("--caption-latency", default="0.3")
+    parser.add_argument("--loading-rate", type=float, default=0.0, help="fracción de respuestas 503")
+
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(args.chat_latency, args.token_interval, args.tokens, args.image_latency,
+                      args.caption_latency, args.loading_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, url = iniciar(config_from_args(args), args.port)
+    print(f"Servidor de prueba en {url} (HF_INFERENCE_BASE={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,57 @@
 # blip_helper.py
 import requests
-import streamlit as st
+import hf_transport
+from image_preprocess import para_modelo, analysis_cache
+from metrics import instrumentado, marcar_error
 
-def get_image_caption(image_bytes: bytes, api_token: str) -> str:
+MODEL_ID = "nlpconnect/vit-gpt2-image-captioning"
+
+
+def describir_imagen(image_bytes: bytes, api_token: str) -> str:
     """
-    Toma los bytes de una imagen y devuelve una descripción usando el modelo BLIP.
+    Igual que get_image_caption, pero lanza una excepción si algo falla.
+    Es la que usa el modo por lotes para contar errores y reintentar.
     """
-    API_URL = "https://api-inference.huggingface.co/models/nlpconnect/vit-gpt2-image-captioning"
-    headers = {"Authorization": f"Bearer {api_token}"}
-    
+    # El modelo trabaja a 384 px: no tiene sentido subir la foto original
+    try:
+        prepared = para_modelo(image_bytes, MODEL_ID)
+    except OSError as e:
+        # PIL no la reconoce o está truncada: reintentar no cambia nada
+        raise ValueError(f"No se pudo leer la imagen: {e}")
+    cached = analysis_cache.get(prepared.hash, MODEL_ID, "caption")
+    if cached is not None:
+        return cached
+    response = hf_transport.post(MODEL_ID, token=api_token, data=prepared.data, headers={"Content-Type": prepared.mime})
+    response.raise_for_status() # Lanza una excepción para errores HTTP (como 404, 503, etc.)
+
+    # --- CORRECCIÓN IMPORTANTE ---
+    # Verificamos si la respuesta es un JSON válido antes de procesarla
     try:
-        response = requests.post(API_URL, headers=headers, data=image_bytes)
-        response.raise_for_status() # Lanza una excepción para errores HTTP (como 404, 503, etc.)
+        json_response = response.json()
+    except requests.exceptions.JSONDecodeError:
+        # Si la respuesta no es JSON (ej. una página de error de HTML), lo indicamos
+        raise ValueError(f"El modelo puede estar sobrecargado. Respuesta recibida: {response.text[:100]}...")
+    if not (isinstance(json_response, list) and json_response):
+        # El JSON es válido pero no tiene el formato esperado
+        raise ValueError(f"La respuesta de la API de imágenes no tuvo el formato esperado: {json_response}")
+    caption = json_response[0].get('generated_text', 'No se pudo generar una descripción.')
+    analysis_cache.put(prepared.hash, MODEL_ID, "caption", caption)
+    return caption
 
-        # --- CORRECCIÓN IMPORTANTE ---
-        # Verificamos si la respuesta es un JSON válido antes de procesarla
-        try:
-            json_response = response.json()
-            if isinstance(json_response, list) and json_response:
-                caption = json_response[0].get('generated_text', 'No se pudo generar una descripción.')
-                return caption
-            else:
-                # El JSON es válido pero no tiene el formato esperado
-                st.error(f"La respuesta de la API de imágenes no tuvo el formato esperado: {json_response}")
-                return None
-        except requests.exceptions.JSONDecodeError:
-            # Si la respuesta no es JSON (ej. una página de error de HTML), lo indicamos
-            st.error(f"Error al analizar la imagen: El modelo puede estar sobrecargado. Respuesta recibida: {response.text[:100]}...")
-            return None
 
+@instrumentado()
+def get_image_caption(image_bytes: bytes, api_token: str) -> str:
+    """
+    Toma los bytes de una imagen y devuelve una descripción usando el modelo BLIP.
+    Si falla, lo escribe en el log y devuelve None.
+    """
+    try:
+        return describir_imagen(image_bytes, api_token)
     except requests.exceptions.RequestException as e:
-        st.error(f"Ocurrió un error de conexión al analizar la imagen: {e}")
+        marcar_error()
+        print(f"Ocurrió un error de conexión al analizar la imagen: {e}")
+        return None
+    except ValueError as e:
+        marcar_error()
+        print(f"Error al analizar la imagen: {e}")
         return None
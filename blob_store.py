@@ -0,0 +1,201 @@
+# blob_store.py
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Bytes de imágenes que se mantienen en RAM antes de volcar las más antiguas a disco
+MEMORY_LIMIT = int(os.environ.get("HEX_BLOB_MEMORY_MB", "64")) * 1024 * 1024
+BLOB_DIR = os.environ.get("HEX_BLOB_DIR") or os.path.join(tempfile.gettempdir(), "hex_blobs")
+# Con los chats guardados en disco, las imágenes también deben sobrevivir a un reinicio
+PERSIST = os.environ.get("HEX_BLOB_PERSIST", "1") == "1"
+# Límites del disco: al pasarlos se borran las imágenes que hace más tiempo no se
+# usan; un chat con una imagen borrada muestra "imagen no disponible"
+DISK_LIMIT = int(os.environ.get("HEX_BLOB_DISK_MB", "2048")) * 1024 * 1024
+MAX_AGE = float(os.environ.get("HEX_BLOB_MAX_AGE_DAYS", "90")) * 86400
+THUMBNAIL_PX = 320
+MAX_THUMBNAILS = 512
+
+
+class BlobStore:
+    """
+    Almacén de imágenes direccionado por SHA-256. Las imágenes idénticas se
+    guardan una sola vez y los mensajes del chat solo conservan el hash. En
+    disco hay un límite de tamaño y de antigüedad con desalojo LRU; la lectura
+    y escritura de archivos se hace fuera del lock.
+    """
+
+    def __init__(self, directory: str = BLOB_DIR, memory_limit: int = MEMORY_LIMIT, persist: bool = PERSIST,
+                 disk_limit: int = DISK_LIMIT, max_age: float = MAX_AGE):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.persist = persist
+        self.disk_limit = disk_limit
+        self.max_age = max_age
+        self._memory = OrderedDict()  # hash -> bytes, en orden de uso
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # hash -> (tamaño, último uso), en orden de uso
+        self._disk_bytes = 0
+        self._thumbnails = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"evictions": 0, "evicted_bytes": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entradas = []
+        for raiz, _, nombres in os.walk(self.directory):
+            for nombre in nombres:
+                if nombre.endswith(".tmp"):
+                    continue
+                st = os.stat(os.path.join(raiz, nombre))
+                entradas.append((st.st_mtime, nombre, st.st_size))
+        for mtime, digest, size in sorted(entradas):
+            self._disk[digest] = (size, mtime)
+            self._disk_bytes += size
+        self._borrar(self._victimas_disco())
+
+    def put(self, data: bytes) -> str:
+        """Guarda los bytes (si no existían) y devuelve su hash."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self._memory:
+                self._memory.move_to_end(digest)
+                return digest
+            if digest in self._disk:
+                self._disk[digest] = (self._disk[digest][0], time.time())
+                self._disk.move_to_end(digest)
+                return digest
+            self._memory[digest] = data
+            self._memory_bytes += len(data)
+        if self.persist:
+            self._guardar(digest, data)
+        self._spill()
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with self._lock:
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+                return data
+            if digest in self._disk:
+                self._disk[digest] = (self._disk[digest][0], time.time())
+                self._disk.move_to_end(digest)
+        path = self._path(digest)
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            os.utime(path)  # el orden LRU sobrevive a un reinicio
+        except OSError:
+            pass
+        return data
+
+    def exists(self, digest: str) -> bool:
+        with self._lock:
+            if digest in self._memory or digest in self._disk:
+                return True
+        # Pudo escribirla otro proceso con el mismo directorio
+        return os.path.exists(self._path(digest))
+
+    def thumbnail(self, digest: str, max_px: int = THUMBNAIL_PX) -> bytes:
+        """Miniatura WebP para el historial; la imagen completa se pide aparte."""
+        key = (digest, max_px)
+        with self._lock:
+            thumb = self._thumbnails.get(key)
+            if thumb is not None:
+                self._thumbnails.move_to_end(key)
+                return thumb
+
+        from PIL import Image
+        image = Image.open(io.BytesIO(self.get(digest)))
+        image.thumbnail((max_px, max_px))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=80)
+        thumb = buffer.getvalue()
+
+        with self._lock:
+            self._thumbnails[key] = thumb
+            while len(self._thumbnails) > MAX_THUMBNAILS:
+                self._thumbnails.popitem(last=False)
+        return thumb
+
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    def disk_bytes(self) -> int:
+        return self._disk_bytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, memory_bytes=self._memory_bytes, disk_bytes=self._disk_bytes,
+                        disk_blobs=len(self._disk))
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _spill(self):
+        # Las más antiguas pasan a disco (si no estaban) y recién entonces salen
+        # de la memoria, para que un get() concurrente siempre las encuentre
+        with self._lock:
+            exceso = self._memory_bytes - self.memory_limit
+            victimas = []
+            for digest, data in self._memory.items():
+                if exceso <= 0 or len(victimas) >= len(self._memory) - 1:
+                    break
+                victimas.append((digest, data))
+                exceso -= len(data)
+            pendientes = [(d, data) for d, data in victimas if d not in self._disk]
+        for digest, data in pendientes:
+            self._guardar(digest, data)
+        with self._lock:
+            for digest, data in victimas:
+                if self._memory.pop(digest, None) is not None:
+                    self._memory_bytes -= len(data)
+
+    def _guardar(self, digest: str, data: bytes):
+        self._write(digest, data)
+        with self._lock:
+            self._disk_bytes += len(data) - self._disk.pop(digest, (0, 0))[0]
+            self._disk[digest] = (len(data), time.time())
+            victimas = self._victimas_disco()
+        self._borrar(victimas)
+
+    def _victimas_disco(self) -> list:
+        # Se llama con self._lock tomado; la más reciente nunca se desaloja
+        limite_uso = time.time() - self.max_age if self.max_age else None
+        victimas = []
+        while len(self._disk) > 1:
+            digest, (size, usado) = next(iter(self._disk.items()))
+            if self._disk_bytes <= self.disk_limit and (limite_uso is None or usado >= limite_uso):
+                break
+            del self._disk[digest]
+            self._disk_bytes -= size
+            self.counters["evictions"] += 1
+            self.counters["evicted_bytes"] += size
+            victimas.append(digest)
+        return victimas
+
+    def _borrar(self, digests: list):
+        for digest in digests:
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
+    def _write(self, digest: str, data: bytes):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+# Compartido por todas las sesiones del proceso
+blob_store = BlobStore()
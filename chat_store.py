@@ -0,0 +1,274 @@
+# chat_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DB_PATH = os.environ.get("HEX_CHAT_DB", "hex_chats.db")
+# Escrituras pendientes a partir de las cuales se vacía la cola sin esperar a flush()
+MAX_PENDING = 32
+
+# `rid` es el rowid explícito de cada tabla: el índice FTS apunta a él, y a
+# diferencia del rowid implícito no cambia con un VACUUM
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    rid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chats_by_user ON chats (user_id, updated_at DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    rid INTEGER PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    extra TEXT,
+    created_at REAL NOT NULL,
+    UNIQUE (chat_id, seq)
+);
+CREATE INDEX IF NOT EXISTS messages_by_id ON messages (id);
+"""
+
+# Índice de texto completo sobre nombres y mensajes. Es de contenido externo (el
+# texto solo se guarda en las tablas) y los triggers lo mantienen al día, así
+# nunca hay que reconstruirlo
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='rid', tokenize='unicode61 remove_diacritics 2');
+CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+    name, content='chats', content_rowid='rid', tokenize='unicode61 remove_diacritics 2');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.rid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rid, old.content);
+    INSERT INTO messages_fts (rowid, content) VALUES (new.rid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rid, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_insert AFTER INSERT ON chats BEGIN
+    INSERT INTO chats_fts (rowid, name) VALUES (new.rid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_update AFTER UPDATE OF name ON chats BEGIN
+    INSERT INTO chats_fts (chats_fts, rowid, name) VALUES ('delete', old.rid, old.name);
+    INSERT INTO chats_fts (rowid, name) VALUES (new.rid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_delete AFTER DELETE ON chats BEGIN
+    INSERT INTO chats_fts (chats_fts, rowid, name) VALUES ('delete', old.rid, old.name);
+END;
+"""
+# Coincidencias que se consideran por búsqueda antes de agrupar por chat. En las
+# consultas, CROSS JOIN obliga a SQLite a partir del índice FTS y no de los chats del usuario
+MAX_SEARCH_HITS = 2000
+
+# Campos del mensaje que tienen columna propia; el resto va en `extra` como JSON
+_COLUMNS = ("id", "role", "content")
+
+
+def _extra(message: dict):
+    extra = {k: v for k, v in message.items() if k not in _COLUMNS}
+    return json.dumps(extra) if extra else None
+
+
+class ChatStore:
+    """
+    Conversaciones en SQLite (modo WAL). La barra lateral solo lee ids y
+    nombres; los mensajes se cargan al abrir un chat. Las escrituras se
+    encolan y se aplican juntas en una transacción.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self.fts = self._init_fts()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._next_seq = {}
+
+    def _init_fts(self) -> bool:
+        """Crea el índice FTS5 (y lo llena con lo ya guardado). False si SQLite no trae FTS5."""
+        existia = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone() is not None
+        try:
+            self._conn.executescript(_FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            print(f"SQLite sin FTS5, la búsqueda de chats usará LIKE: {e}")
+            return False
+        if not existia:
+            with self._conn:
+                self._conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+                self._conn.execute("INSERT INTO chats_fts (chats_fts) VALUES ('rebuild')")
+        return True
+
+    def create_chat(self, user_id: str, chat_id: str, name: str):
+        now = time.time()
+        self._queue("INSERT OR IGNORE INTO chats (id, user_id, name, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (chat_id, user_id, name, now, now))
+
+    def append_message(self, chat_id: str, message: dict):
+        """Añade un mensaje al final del chat (nunca reescribe los anteriores)."""
+        now = time.time()
+        with self._lock:
+            seq = self._next_seq.get(chat_id)
+            if seq is None:
+                self._flush_locked()
+                row = self._conn.execute("SELECT COALESCE(MAX(seq), -1) FROM messages WHERE chat_id = ?", (chat_id,)).fetchone()
+                seq = row[0] + 1
+            self._next_seq[chat_id] = seq + 1
+        self._queue("INSERT INTO messages (chat_id, seq, id, role, content, extra, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (chat_id, seq, message["id"], message["role"], message.get("content", ""), _extra(message), now))
+        self._queue("UPDATE chats SET updated_at = ? WHERE id = ?", (now, chat_id))
+
+    def update_message(self, chat_id: str, message: dict):
+        """Actualiza un mensaje ya guardado (p. ej. cuando termina una imagen en segundo plano)."""
+        self._queue("UPDATE messages SET content = ?, extra = ? WHERE chat_id = ? AND id = ?",
+                    (message.get("content", ""), _extra(message), chat_id, message["id"]))
+
+    def list_chats(self, user_id: str, limit: int = 20, offset: int = 0):
+        """[(id, nombre)] de los chats del usuario, del más reciente al más antiguo."""
+        self.flush()
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, name FROM chats WHERE user_id = ? ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (user_id, limit, offset),
+            ).fetchall()
+
+    def search_chats(self, user_id: str, query: str, limit: int = 20, offset: int = 0):
+        """
+        [(id, nombre)] de los chats del usuario cuyo nombre o algún mensaje
+        contiene todas las palabras de la búsqueda (también como prefijo), por relevancia.
+        """
+        palabras = query.split()
+        if not palabras:
+            return self.list_chats(user_id, limit, offset)
+        self.flush()
+        if not self.fts:
+            return self._search_like(user_id, palabras, limit, offset)
+        match = " ".join('"' + p.replace('"', '""') + '"*' for p in palabras)
+        with self._lock:
+            return self._conn.execute(
+                """
+                SELECT c.id, c.name FROM chats c
+                JOIN (
+                    SELECT chat_id, MIN(score) AS score FROM (
+                        SELECT * FROM (
+                            SELECT m.chat_id AS chat_id, f.rank AS score
+                            FROM messages_fts f
+                            CROSS JOIN messages m ON m.rid = f.rowid
+                            CROSS JOIN chats c3 ON c3.id = m.chat_id
+                            WHERE messages_fts MATCH ?1 AND c3.user_id = ?2
+                            ORDER BY f.rank LIMIT ?5
+                        )
+                        UNION ALL
+                        SELECT c2.id, f2.rank * 2 FROM chats_fts f2 CROSS JOIN chats c2 ON c2.rid = f2.rowid
+                        WHERE chats_fts MATCH ?1 AND c2.user_id = ?2
+                    ) GROUP BY chat_id
+                ) hits ON hits.chat_id = c.id
+                WHERE c.user_id = ?2
+                ORDER BY hits.score, c.updated_at DESC LIMIT ?3 OFFSET ?4
+                """,
+                (match, user_id, limit, offset, MAX_SEARCH_HITS),
+            ).fetchall()
+
+    def _search_like(self, user_id: str, palabras: list, limit: int, offset: int):
+        condiciones, params = [], [user_id]
+        for p in palabras:
+            patron = "%" + p.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            condiciones.append(
+                "(c.name LIKE ? ESCAPE '\\' OR EXISTS (SELECT 1 FROM messages m WHERE m.chat_id = c.id AND m.content LIKE ? ESCAPE '\\'))"
+            )
+            params += [patron, patron]
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT c.id, c.name FROM chats c WHERE c.user_id = ? AND {' AND '.join(condiciones)} "
+                "ORDER BY c.updated_at DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+
+    def count_chats(self, user_id: str) -> int:
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chats WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def get_chat(self, chat_id: str):
+        self.flush()
+        with self._lock:
+            row = self._conn.execute("SELECT id, user_id, name FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        return {"id": row[0], "user_id": row[1], "name": row[2]} if row else None
+
+    def load_messages(self, chat_id: str, last: int = None) -> list:
+        """Mensajes del chat en orden; con `last`, solo los últimos `last`."""
+        self.flush()
+        with self._lock:
+            if last is None:
+                rows = self._conn.execute(
+                    "SELECT id, role, content, extra FROM messages WHERE chat_id = ? ORDER BY seq", (chat_id,)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT id, role, content, extra FROM messages WHERE chat_id = ? ORDER BY seq DESC LIMIT ?",
+                    (chat_id, last),
+                ).fetchall()[::-1]
+        messages = []
+        for message_id, role, content, extra in rows:
+            message = {"id": message_id, "role": role, "content": content}
+            if extra:
+                message.update(json.loads(extra))
+            messages.append(message)
+        return messages
+
+    def count_messages(self, chat_id: str) -> int:
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _queue(self, sql, params):
+        with self._lock:
+            self._pending.append((sql, params))
+            if len(self._pending) >= MAX_PENDING:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        # La cola se vacía solo tras el commit: si la base está bloqueada o el disco
+        # lleno, la transacción se deshace y las escrituras esperan al próximo flush
+        if not self._pending:
+            return
+        try:
+            with self._conn:
+                for sql, params in self._pending:
+                    self._conn.execute(sql, params)
+        except sqlite3.IntegrityError as e:
+            # Una escritura inválida no puede bloquear a las demás: se aplican de a una
+            print(f"Escritura de chats rechazada, se reintenta una por una: {e}")
+            hechas = 0
+            try:
+                for sql, params in self._pending:
+                    try:
+                        with self._conn:
+                            self._conn.execute(sql, params)
+                    except sqlite3.IntegrityError as e:
+                        print(f"Se descarta la escritura {sql.split('(')[0].strip()}: {e}")
+                    hechas += 1
+            finally:
+                # Si otro error corta el bucle, lo ya aplicado o descartado no se repite
+                del self._pending[:hechas]
+            return
+        self._pending = []
+
+
+# Una conexión por proceso, compartida por todas las sesiones
+chat_store = ChatStore()
@@ -0,0 +1,165 @@
+# context_builder.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+# Presupuesto de tokens del prompt (sistema + resumen + turnos recientes + mensaje actual)
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("HEX_CONTEXT_TOKEN_BUDGET", "3072"))
+TOKENIZER_ID = "meta-llama/Meta-Llama-3-8B-Instruct"
+# <|start_header_id|>rol<|end_header_id|>\n\n ... <|eot_id|> que añade la plantilla de Llama-3
+MESSAGE_OVERHEAD = 5
+# El resumen se rehace cada tantos mensajes descartados, no en cada turno
+SUMMARY_BLOCK = 8
+
+# Tras un fallo al cargar el tokenizador se estima durante este tiempo y luego se reintenta
+TOKENIZER_RETRY = float(os.environ.get("HEX_TOKENIZER_RETRY_S", "600"))
+
+_tokenizer = None  # None: sin cargar; False: falló la última carga
+_tokenizer_failed_at = 0.0
+_tokenizer_loading = False
+_tokenizer_lock = threading.Lock()
+
+
+def cargar_tokenizador():
+    """
+    Descarga y carga el tokenizador de Llama-3; bloquea mientras tanto. Lo llama
+    el precalentamiento o un hilo aparte: una petición nunca espera la descarga.
+    """
+    global _tokenizer, _tokenizer_failed_at, _tokenizer_loading
+    with _tokenizer_lock:
+        if _tokenizer or _tokenizer_loading:
+            return _tokenizer
+        _tokenizer_loading = True
+    try:
+        from transformers import AutoTokenizer
+        # El repo de Llama-3 es privado: hace falta el mismo token que usa la app
+        token = os.environ.get("HUGGINGFACE_API_TOKEN") or os.environ.get("HF_TOKEN")
+        tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_ID, token=token)
+    except Exception as e:
+        print(f"No se pudo cargar el tokenizador de Llama-3, se estimarán los tokens: {e}")
+        with _tokenizer_lock:
+            _tokenizer, _tokenizer_failed_at, _tokenizer_loading = False, time.time(), False
+        return False
+    with _tokenizer_lock:
+        _tokenizer, _tokenizer_loading = tokenizer, False
+    count_tokens.cache_clear()  # descarta las estimaciones hechas mientras no estaba
+    return tokenizer
+
+
+def _get_tokenizer():
+    """
+    El tokenizador si ya está cargado. Si no, lanza la carga en segundo plano
+    (salvo que esté en curso o en la espera tras un fallo) y devuelve None.
+    """
+    with _tokenizer_lock:
+        if _tokenizer or _tokenizer_loading:
+            return _tokenizer or None
+        if _tokenizer is False and time.time() - _tokenizer_failed_at < TOKENIZER_RETRY:
+            return None
+    threading.Thread(target=cargar_tokenizador, name="hex-tokenizer", daemon=True).start()
+    return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    Cuenta los tokens de un texto con el tokenizador de Llama-3, o los estima
+    mientras se carga o si no se pudo cargar.
+    """
+    tokenizer = _get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return len(text) // 4 + 1
+
+
+def _message_tokens(msg: dict) -> int:
+    return count_tokens(msg.get("content", "") or "") + MESSAGE_OVERHEAD
+
+
+def _digest(messages) -> str:
+    h = hashlib.sha1()
+    for msg in messages:
+        h.update(msg.get("role", "").encode())
+        h.update(b"\0")
+        h.update((msg.get("content", "") or "").encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ContextBuilder:
+    """
+    Arma la lista de mensajes para chat_completion: el prompt de sistema, un
+    resumen de los turnos antiguos y los turnos más recientes que quepan en el
+    presupuesto de tokens.
+    """
+
+    def __init__(self, budget: int = DEFAULT_TOKEN_BUDGET, summarizer=None,
+                 summary_budget: int = 400, max_summaries: int = 256):
+        self.budget = budget
+        self.summarizer = summarizer  # summarizer(resumen_previo, mensajes) -> str
+        self.summary_budget = summary_budget
+        self.max_summaries = max_summaries
+        self._summaries = OrderedDict()  # chat_key -> (n_mensajes, digest, resumen)
+        self._lock = threading.Lock()
+
+    def build(self, system_prompt: str, history: list, user_message: str, chat_key=None):
+        """Devuelve (messages, tokens_enviados)."""
+        system_msg = {"role": "system", "content": system_prompt}
+        user_msg = {"role": "user", "content": user_message}
+        used = _message_tokens(system_msg) + _message_tokens(user_msg)
+        available = self.budget - used
+        if self.summarizer:
+            available -= self.summary_budget + MESSAGE_OVERHEAD
+
+        # Recorremos el historial desde el final mientras quepa
+        cut = len(history)
+        for msg in reversed(history):
+            cost = _message_tokens(msg)
+            if cost > available:
+                break
+            available -= cost
+            cut -= 1
+
+        if cut and self.summarizer:
+            cut = min(len(history), -(-cut // SUMMARY_BLOCK) * SUMMARY_BLOCK)
+
+        messages = [system_msg]
+        summary = self._summary(chat_key, history[:cut]) if cut else None
+        if summary:
+            messages.append({"role": "system", "content": f"Resumen de la conversación anterior: {summary}"})
+        messages.extend({"role": "user" if m["role"] == "user" else "assistant", "content": m.get("content", "")}
+                        for m in history[cut:])
+        messages.append(user_msg)
+        return messages, sum(_message_tokens(m) for m in messages)
+
+    def _summary(self, chat_key, dropped: list):
+        if not self.summarizer:
+            return None
+        key = chat_key if chat_key is not None else _digest(dropped[:1])
+        with self._lock:
+            cached = self._summaries.get(key)
+        previous, start = None, 0
+        if cached:
+            n, digest, text = cached
+            if n == len(dropped) and digest == _digest(dropped):
+                with self._lock:
+                    self._summaries.move_to_end(key)
+                return text
+            if n < len(dropped) and digest == _digest(dropped[:n]):
+                previous, start = text, n
+
+        try:
+            text = self.summarizer(previous, dropped[start:])
+        except Exception as e:
+            print(f"No se pudo resumir el historial: {e}")
+            return previous
+
+        with self._lock:
+            self._summaries[key] = (len(dropped), _digest(dropped), text)
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_summaries:
+                self._summaries.popitem(last=False)
+        return text
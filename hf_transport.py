@@ -0,0 +1,144 @@
+# hf_transport.py
+import os
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import registrar_http
+
+HF_API_BASE = os.environ.get("HF_INFERENCE_BASE", "https://api-inference.huggingface.co").rstrip("/")
+# Con otra base (p. ej. los servidores de prueba de benchmarks/) el InferenceClient también apunta ahí
+CUSTOM_BASE = "HF_INFERENCE_BASE" in os.environ
+
+# (connect, read) en segundos; la generación de imágenes tarda bastante más que el resto
+DEFAULT_TIMEOUT = (5, 60)
+ENDPOINT_TIMEOUTS = {
+    "black-forest-labs/FLUX.1-dev": (5, 180),
+    "stabilityai/stable-diffusion-2": (5, 120),
+    "nlpconnect/vit-gpt2-image-captioning": (5, 30),
+    "meta-llama/Meta-Llama-3-8B-Instruct": (5, 120),
+}
+
+# Peticiones simultáneas por modelo y reintentos ante "model loading" (503)
+MAX_IN_FLIGHT = int(os.environ.get("HEX_HF_MAX_IN_FLIGHT", "4"))
+MAX_RETRIES = int(os.environ.get("HEX_HF_MAX_RETRIES", "4"))
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+_lock = threading.Lock()
+_session = None
+_semaphores = {}
+_clients = {}
+
+
+def get_session() -> requests.Session:
+    """Sesión compartida con keep-alive: reutiliza las conexiones TLS entre llamadas."""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def model_url(model: str) -> str:
+    return f"{HF_API_BASE}/models/{model}"
+
+
+def timeout_for(model: str):
+    return ENDPOINT_TIMEOUTS.get(model, DEFAULT_TIMEOUT)
+
+
+def _semaphore(model: str) -> threading.BoundedSemaphore:
+    with _lock:
+        if model not in _semaphores:
+            _semaphores[model] = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+        return _semaphores[model]
+
+
+def _backoff_delay(attempt: int, response) -> float:
+    """Backoff exponencial con jitter; respeta `estimated_time` si la API lo indica."""
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+    try:
+        estimated = float(response.json().get("estimated_time", 0))
+    except Exception:
+        estimated = 0
+    if estimated:
+        delay = min(BACKOFF_CAP, estimated)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RequestCancelled(Exception):
+    """La petición se canceló (p. ej. otra réplica respondió antes)."""
+
+    metric_status = "cancelled"
+
+
+def post(model: str, token: str = None, json=None, data=None, headers=None, timeout=None,
+         cancel_event: threading.Event = None) -> requests.Response:
+    """
+    POST a la Inference API de un modelo. Reintenta las respuestas 503 mientras
+    el modelo se carga y limita las peticiones simultáneas por modelo.
+    Devuelve la última respuesta; los errores HTTP los decide quien llama.
+    Si se activa `cancel_event`, deja de reintentar y lanza RequestCancelled.
+    """
+    all_headers = {}
+    if token:
+        all_headers["Authorization"] = f"Bearer {token}"
+    all_headers.update(headers or {})
+    timeout = timeout or timeout_for(model)
+    session = get_session()
+
+    cancel_event = cancel_event or threading.Event()
+    for attempt in range(MAX_RETRIES + 1):
+        with _semaphore(model):
+            if cancel_event.is_set():
+                raise RequestCancelled(model)
+            response = session.post(model_url(model), headers=all_headers, json=json, data=data, timeout=timeout)
+        registrar_http(len(response.request.body or b""), len(response.content), retry=attempt > 0)
+        if response.status_code != 503 or attempt == MAX_RETRIES:
+            return response
+        delay = _backoff_delay(attempt, response)
+        print(f"'{model}' se está cargando (503), reintento {attempt + 1} en {delay:.1f}s")
+        if cancel_event.wait(delay):
+            raise RequestCancelled(model)
+    return response
+
+
+def call(model: str, fn, cancel_event: threading.Event = None):
+    """
+    Ejecuta fn() (p. ej. un método de InferenceClient) con el mismo límite de
+    peticiones simultáneas por modelo y los mismos reintentos ante 503 que post().
+    """
+    cancel_event = cancel_event or threading.Event()
+    for attempt in range(MAX_RETRIES + 1):
+        with _semaphore(model):
+            if cancel_event.is_set():
+                raise RequestCancelled(model)
+            try:
+                return fn()
+            except Exception as e:
+                response = getattr(e, "response", None)
+                if getattr(response, "status_code", None) != 503 or attempt == MAX_RETRIES:
+                    raise
+        registrar_http(retry=True)
+        delay = _backoff_delay(attempt, response)
+        print(f"'{model}' se está cargando (503), reintento {attempt + 1} en {delay:.1f}s")
+        if cancel_event.wait(delay):
+            raise RequestCancelled(model)
+
+
+def get_inference_client(model: str, token: str = None):
+    """InferenceClient compartido por modelo, con el timeout de lectura del endpoint."""
+    key = (model, token)
+    with _lock:
+        if key not in _clients:
+            from huggingface_hub import InferenceClient
+            target = model_url(model) if CUSTOM_BASE else model
+            _clients[key] = InferenceClient(model=target, token=token, timeout=timeout_for(model)[1])
+        return _clients[key]
@@ -0,0 +1,215 @@
+# image_cache.py
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+CACHE_DIR = os.environ.get("HEX_IMAGE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "hex_image_cache")
+MAX_BYTES = int(os.environ.get("HEX_IMAGE_CACHE_MB", "512")) * 1024 * 1024
+WEBP_QUALITY = 90
+# Cada cuánto revisa su cancel_event quien espera una generación compartida
+WAIT_POLL = 0.25
+
+
+def normalize_prompt(prompt: str) -> str:
+    # Solo mayúsculas y espacios: la puntuación y los acentos sí cambian la imagen
+    return " ".join(prompt.casefold().split())
+
+
+def cache_key(model: str, prompt: str, params: dict = None) -> str:
+    raw = json.dumps([model, normalize_prompt(prompt), params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def a_webp(image_bytes: bytes, quality: int = WEBP_QUALITY) -> bytes:
+    from PIL import Image
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=quality)
+    return buffer.getvalue()
+
+
+class _Generacion:
+    """Una generación en curso, compartida por todos los que piden la misma imagen."""
+
+    __slots__ = ("future", "cancel_event", "waiters")
+
+    def __init__(self):
+        self.future = Future()
+        # Propio de la generación: solo se activa cuando ya nadie la espera
+        self.cancel_event = threading.Event()
+        self.waiters = 0
+
+
+class ImageCache:
+    """
+    Imágenes generadas por (modelo, prompt normalizado, parámetros), en WebP en
+    disco con desalojo LRU por tamaño. Las peticiones idénticas simultáneas,
+    aunque vengan de sesiones distintas, esperan a la única generación en curso.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index = OrderedDict()  # clave -> tamaño en bytes, en orden de uso
+        self._total = 0
+        self._inflight = {}  # clave -> _Generacion
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hex-image-cache")
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0, "evictions": 0,
+                         "generation_seconds": 0.0, "seconds_saved": 0.0}
+        self._seconds = {}  # clave -> lo que tardó en generarse, para estimar el ahorro
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entradas = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".webp"):
+                path = os.path.join(self.directory, name)
+                st = os.stat(path)
+                entradas.append((st.st_mtime, name[:-5], st.st_size))
+        for _, key, size in sorted(entradas):
+            self._index[key] = size
+            self._total += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.webp")
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))  # el orden LRU sobrevive a un reinicio
+            return data
+        except OSError:
+            with self._lock:
+                self._total -= self._index.pop(key, 0)
+            return None
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._total += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._evict()
+
+    def _evict(self):
+        # Se llama con self._lock tomado
+        while self._total > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self._total -= size
+            self._seconds.pop(key, None)
+            self.counters["evictions"] += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get_or_create(self, model: str, prompt: str, fn, params: dict = None, cancel_event: threading.Event = None):
+        """
+        Devuelve (bytes WebP, origen) con origen "hit", "coalesced" o "generated".
+        `fn(cancel_event)` solo se llama si la imagen no está en caché ni
+        generándose, y corre aparte: no depende de quien la pidió primero.
+        `fn` devuelve los bytes, o (bytes, modelo) si la imagen la hizo otro
+        modelo (un respaldo): entonces se guarda bajo la clave de ese modelo.
+        Si se activa el `cancel_event` del que llama, este deja de esperar
+        (RequestCancelled) pero la generación sigue para los demás; se cancela
+        solo cuando ya no la espera nadie.
+        """
+        key = cache_key(model, prompt, params)
+        data = self.get(key)
+        if data is not None:
+            self._record_saved("hits", key)
+            return data, "hit"
+
+        with self._lock:
+            generacion = self._inflight.get(key)
+            # Otra generación pudo terminar y guardarse entre el get() y el lock
+            guardada = generacion is None and key in self._index
+            owner = generacion is None and not guardada
+            if owner:
+                generacion = self._inflight[key] = _Generacion()
+                self.counters["misses"] += 1
+                self._executor.submit(self._generar, key, model, prompt, params, fn, generacion)
+            if generacion is not None:
+                generacion.waiters += 1
+        if guardada:
+            data = self.get(key)
+            if data is None:  # el archivo desapareció: se genera de nuevo
+                return self.get_or_create(model, prompt, fn, params, cancel_event)
+            self._record_saved("hits", key)
+            return data, "hit"
+
+        data = self._esperar(generacion, cancel_event)  # si la generación falla, la excepción llega aquí
+        if owner:
+            return data, "generated"
+        self._record_saved("coalesced", key)
+        return data, "coalesced"
+
+    def _esperar(self, generacion, cancel_event):
+        try:
+            while True:
+                try:
+                    return generacion.future.result(timeout=WAIT_POLL if cancel_event is not None else None)
+                except FutureTimeout:
+                    if cancel_event.is_set():
+                        from hf_transport import RequestCancelled
+                        raise RequestCancelled("imagen en caché")
+        finally:
+            with self._lock:
+                generacion.waiters -= 1
+                if generacion.waiters == 0 and not generacion.future.done():
+                    generacion.cancel_event.set()
+
+    def _generar(self, key, model, prompt, params, fn, generacion):
+        start = time.perf_counter()
+        try:
+            resultado = fn(generacion.cancel_event)
+            image_bytes, modelo = resultado if isinstance(resultado, tuple) else (resultado, model)
+            data = a_webp(image_bytes)
+            key_real = key if modelo == model else cache_key(modelo, prompt, params)
+            self.put(key_real, data)
+        except BaseException as e:
+            with self._lock:
+                self.counters["errors"] += 1
+                del self._inflight[key]
+            generacion.future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._seconds[key_real] = elapsed
+            self.counters["generation_seconds"] += elapsed
+            del self._inflight[key]
+        generacion.future.set_result(data)
+
+    def _record_saved(self, counter: str, key: str):
+        with self._lock:
+            self.counters[counter] += 1
+            self.counters["seconds_saved"] += self._seconds.get(key, 0.0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+            return dict(self.counters, entries=len(self._index), bytes=self._total,
+                        inflight=len(self._inflight),
+                        hit_rate=(self.counters["hits"] + self.counters["coalesced"]) / total if total else 0.0)
+
+
+# Compartida por todas las sesiones: así se agrupan las peticiones repetidas
+image_cache = ImageCache()
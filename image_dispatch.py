@@ -0,0 +1,219 @@
+# image_dispatch.py
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from hf_transport import RequestCancelled
+
+# Antes de tener muestras suficientes, se cubre con el secundario pasado este tiempo
+DEFAULT_HEDGE_AFTER = float(os.environ.get("HEX_IMAGE_HEDGE_AFTER", "60"))
+HEDGE_PERCENTILE = 0.9
+MIN_SAMPLES = 5
+# Fallos seguidos que abren el circuito y tiempo que el backend queda fuera
+BREAKER_THRESHOLD = int(os.environ.get("HEX_IMAGE_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.environ.get("HEX_IMAGE_BREAKER_COOLDOWN", "120"))
+# Cada cuánto se mira el cancel_event de quien llama mientras se espera a los backends
+CANCEL_POLL = 0.25
+
+
+class BackendStats:
+    """Latencias y errores recientes de un backend, más su cortocircuito."""
+
+    def __init__(self, window: int = 100):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True = éxito
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False  # hay una petición de prueba en curso con el circuito medio abierto
+
+    def percentile(self, q: float):
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordenadas = sorted(self.latencies)
+        return ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))]
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def is_open(self) -> bool:
+        return time.time() < self.open_until
+
+    def available(self) -> bool:
+        return not self.is_open() and not self.probing
+
+    def admit(self) -> bool:
+        """
+        True si se le puede mandar una petición. Pasado el enfriamiento el
+        circuito queda medio abierto: pasa una sola petición de prueba y el
+        resto lo sigue saltando hasta que esa responda.
+        """
+        if not self.available():
+            return False
+        if self.open_until:
+            self.probing = True
+        return True
+
+    def release_probe(self):
+        # La prueba se canceló sin resultado: puede intentarlo otra petición
+        self.probing = False
+
+    def record_success(self, seconds: float):
+        self.latencies.append(seconds)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def record_failure(self, cooldown: float):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        # Una prueba fallida vuelve a abrir el circuito sin esperar más fallos
+        if self.probing or self.consecutive_failures >= BREAKER_THRESHOLD:
+            self.open_until = time.time() + cooldown
+        self.probing = False
+
+
+class ImageDispatcher:
+    """
+    Genera imágenes con varios backends en orden de preferencia. Si el primario
+    pasa su p90 de latencia se lanza en paralelo el siguiente y gana el que
+    termine antes; el otro deja de reintentar y su resultado se descarta (la
+    petición HTTP que ya está en vuelo no se puede cortar). Un backend que falla
+    seguido se salta durante un tiempo (cortocircuito).
+    """
+
+    def __init__(self, backends: list, hedge_after: float = DEFAULT_HEDGE_AFTER,
+                 cooldown: float = BREAKER_COOLDOWN, max_workers: int = 8):
+        self.backends = backends  # [(nombre, fn(prompt, token, cancel_event) -> bytes)]
+        self.hedge_after = hedge_after
+        self.cooldown = cooldown
+        self._backends = {name: BackendStats() for name, _ in backends}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hex-dispatch")
+        self.counters = {"hedged": 0, "hedge_wins": 0, "failovers": 0, "skipped_open": 0}
+
+    def generate(self, prompt: str, token: str, cancel_event: threading.Event = None):
+        """
+        Devuelve (bytes de la imagen, nombre del backend que respondió). Si se
+        activa `cancel_event` se deja de esperar: no se lanzan más backends ni
+        reintentos y se lanza RequestCancelled.
+        """
+        with self._lock:
+            candidatos = [b for b in self.backends if self._backends[b[0]].available()]
+            self.counters["skipped_open"] += len(self.backends) - len(candidatos)
+        # Con todos los circuitos abiertos se intenta igual, en el orden normal
+        forzar = not candidatos
+        restantes = candidatos or list(self.backends)
+
+        # Propio de esta llamada: corta a los perdedores sin tocar el evento de quien llama
+        cancel = threading.Event()
+        en_curso = {}
+        errores = []
+        lanzados = []
+        hedge_at = [0.0]
+
+        def lanzar_siguiente() -> bool:
+            while restantes and not cancel.is_set():
+                name, fn = restantes.pop(0)
+                with self._lock:
+                    if not forzar and not self._backends[name].admit():
+                        self.counters["skipped_open"] += 1
+                        continue
+                en_curso[self._executor.submit(self._call, name, fn, prompt, token, cancel)] = name
+                lanzados.append(name)
+                hedge_at[0] = time.monotonic() + self._hedge_delay(en_curso)
+                return True
+            return False
+
+        if not lanzar_siguiente() and not cancel.is_set():
+            # Otra petición ya está probando cada circuito medio abierto: se intenta igual
+            forzar, restantes[:] = True, list(self.backends)
+            lanzar_siguiente()
+        while en_curso:
+            if cancel_event is not None and cancel_event.is_set():
+                # Sin más backends ni reintentos; lo que está en vuelo se descarta
+                cancel.set()
+                raise RequestCancelled(prompt)
+            timeout = max(0.0, hedge_at[0] - time.monotonic()) if restantes and not cancel.is_set() else None
+            if cancel_event is not None and not cancel.is_set():
+                timeout = CANCEL_POLL if timeout is None else min(timeout, CANCEL_POLL)
+            hechos, _ = wait(list(en_curso), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not hechos:
+                if restantes and not cancel.is_set() and time.monotonic() >= hedge_at[0]:
+                    # El primario va lento: se cubre con el siguiente backend
+                    lento = next(iter(en_curso.values()))
+                    if lanzar_siguiente():
+                        with self._lock:
+                            self.counters["hedged"] += 1
+                        print(f"Imagen: '{lento}' supera su p90, lanzando '{lanzados[-1]}'")
+                continue
+            for future in hechos:
+                name = en_curso.pop(future)
+                try:
+                    image_bytes = future.result()
+                except Exception as e:
+                    errores.append(e)
+                    if not en_curso and lanzar_siguiente():
+                        with self._lock:
+                            self.counters["failovers"] += 1
+                    continue
+                cancel.set()  # el perdedor deja de reintentar y su resultado se descarta
+                with self._lock:
+                    if name != lanzados[0]:
+                        self.counters["hedge_wins"] += 1
+                return image_bytes, name
+        raise errores[-1] if errores else RuntimeError("Ningún backend de imágenes disponible")
+
+    def _hedge_delay(self, en_curso) -> float:
+        name = next(iter(en_curso.values()))
+        with self._lock:
+            p90 = self._backends[name].percentile(HEDGE_PERCENTILE)
+        return p90 if p90 is not None else self.hedge_after
+
+    def _call(self, name, fn, prompt, token, cancel):
+        start = time.perf_counter()
+        try:
+            result = fn(prompt, token, cancel)
+        except RequestCancelled:
+            with self._lock:
+                self._backends[name].release_probe()
+            raise
+        except Exception:
+            with self._lock:
+                self._backends[name].record_failure(self.cooldown)
+            raise
+        with self._lock:
+            self._backends[name].record_success(time.perf_counter() - start)
+        return result
+
+    def stats(self) -> dict:
+        """p50/p90, tasa de error y estado del circuito por backend."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "backends": {
+                    name: {
+                        "p50_s": s.percentile(0.5),
+                        "p90_s": s.percentile(0.9),
+                        "error_rate": s.error_rate,
+                        "circuit_open": s.is_open(),
+                        "probing": s.probing,
+                    }
+                    for name, s in self._backends.items()
+                },
+            }
+
+
+def _crear_dispatcher():
+    from imagegen_flux import generar_imagen_flux_bytes, generar_imagen_sd_bytes
+    return ImageDispatcher([
+        ("flux", generar_imagen_flux_bytes),
+        ("sd2", generar_imagen_sd_bytes),
+    ])
+
+
+# Compartido por todas las sesiones para que las estadísticas reflejen todo el tráfico
+image_dispatcher = _crear_dispatcher()
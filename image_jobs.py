@@ -0,0 +1,135 @@
+# image_jobs.py
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = int(os.environ.get("HEX_IMAGE_WORKERS", "2"))
+MAX_JOBS_PER_USER = int(os.environ.get("HEX_IMAGE_JOBS_PER_USER", "2"))
+# Los trabajos terminados se guardan un rato para que la sesión los recoja
+JOB_TTL = 3600
+
+QUEUED, RUNNING, DONE, ERROR, CANCELLED = "queued", "running", "done", "error", "cancelled"
+PENDING = (QUEUED, RUNNING)
+
+
+class JobLimitError(Exception):
+    """El usuario ya tiene el máximo de trabajos en curso."""
+
+
+class Job:
+    def __init__(self, user_id, prompt):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.prompt = prompt
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        # Lo activa cancel(); llega hasta hf_transport para dejar de reintentar
+        self.cancel_event = threading.Event()
+
+    @property
+    def wait_seconds(self):
+        end = self.started_at or time.time()
+        return end - self.submitted_at
+
+
+class JobQueue:
+    """
+    Cola de trabajos en segundo plano con un pool acotado de hilos. Vive a nivel
+    de proceso, así que un trabajo sobrevive a los reruns de la página.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_per_user: int = MAX_JOBS_PER_USER):
+        self.max_per_user = max_per_user
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hex-image")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._waits = []  # esperas recientes en cola, en segundos
+
+    def submit(self, user_id, prompt, fn, *args) -> str:
+        """
+        Encola fn(*args, cancel_event=...) y devuelve el id del trabajo sin
+        esperar. `cancel_event` se activa si el trabajo se cancela.
+        """
+        self._purge()
+        with self._lock:
+            activos = sum(1 for j in self._jobs.values() if j.user_id == user_id and self._ocupa(j))
+            if activos >= self.max_per_user:
+                raise JobLimitError(f"Ya tienes {activos} imágenes en proceso, espera a que terminen.")
+            job = Job(user_id, prompt)
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job, fn, args)
+        return job.id
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id) -> bool:
+        """
+        Cancela un trabajo. Si ya está en ejecución, la petición HTTP en curso no
+        se puede cortar: se activa su cancel_event para que no reintente y su
+        resultado se descarta. Sigue contando para el límite hasta que termine.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in PENDING:
+                return False
+            job.status = CANCELLED
+            job.finished_at = time.time()
+        job.cancel_event.set()
+        job.future.cancel()
+        return True
+
+    @staticmethod
+    def _ocupa(job) -> bool:
+        # Un trabajo cancelado a mitad sigue ocupando un hilo hasta que vuelve
+        return job.status in PENDING or (job.future is not None and not job.future.done())
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            running = sum(1 for j in self._jobs.values() if j.status == RUNNING)
+            waits = list(self._waits)
+        return {
+            "queue_depth": queued,
+            "running": running,
+            "avg_wait_s": sum(waits) / len(waits) if waits else 0.0,
+            "max_wait_s": max(waits) if waits else 0.0,
+        }
+
+    def _run(self, job, fn, args):
+        with self._lock:
+            if job.status == CANCELLED:
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+            self._waits.append(job.wait_seconds)
+            del self._waits[:-100]
+        print(f"Trabajo de imagen {job.id[:8]} iniciado tras {job.wait_seconds:.1f}s en cola "
+              f"({self.stats()['queue_depth']} en espera)")
+        try:
+            result, error = fn(*args, cancel_event=job.cancel_event), None
+        except Exception as e:
+            result, error = None, e
+        with self._lock:
+            if job.status == CANCELLED:
+                return
+            job.result, job.error = result, error
+            job.status = DONE if error is None else ERROR
+            job.finished_at = time.time()
+
+    def _purge(self):
+        limite = time.time() - JOB_TTL
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < limite]:
+                del self._jobs[job_id]
+
+
+# Una cola por proceso, compartida por todas las sesiones
+job_queue = JobQueue()
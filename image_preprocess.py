@@ -0,0 +1,89 @@
+# image_preprocess.py
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Lado mayor (px) con el que trabaja cada modelo de visión. LLaVA-1.6 divide la
+# imagen en mosaicos de 336 px hasta 672 px; el modelo de descripciones usa 384.
+MODEL_INPUT_SIZES = {
+    "llava-hf/llava-1.6-mistral-7b-hf": 672,
+    "nlpconnect/vit-gpt2-image-captioning": 384,
+}
+DEFAULT_INPUT_SIZE = 384
+
+PreparedImage = namedtuple("PreparedImage", "data hash mime width height original_bytes seconds")
+
+
+def preparar_imagen(image_bytes: bytes, max_side: int = DEFAULT_INPUT_SIZE, formato: str = "JPEG", quality: int = 85) -> PreparedImage:
+    """
+    Decodifica la imagen a resolución reducida (modo draft de Pillow), aplica la
+    orientación EXIF, la reduce al tamaño del modelo y la recodifica compacta.
+    El hash es del resultado, así dos subidas iguales comparten análisis.
+    """
+    from PIL import Image, ImageOps
+
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(image_bytes))
+    # Para JPEG, draft decodifica directamente a 1/2, 1/4 u 1/8 de la resolución
+    image.draft("RGB", (max_side * 2, max_side * 2))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        # El formato de salida no tiene alfa: lo transparente va sobre blanco, no negro
+        image = image.convert("RGBA")
+        fondo = Image.new("RGB", image.size, (255, 255, 255))
+        fondo.paste(image, mask=image.getchannel("A"))
+        image = fondo
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=formato, quality=quality, optimize=True)
+    data = buffer.getvalue()
+    prepared = PreparedImage(
+        data=data,
+        hash=hashlib.sha256(data).hexdigest(),
+        mime=f"image/{formato.lower()}",
+        width=image.width,
+        height=image.height,
+        original_bytes=len(image_bytes),
+        seconds=time.perf_counter() - start,
+    )
+    ahorro = 1 - len(data) / len(image_bytes) if image_bytes else 0
+    print(f"Imagen preparada: {len(image_bytes) / 1024:.0f} KB -> {len(data) / 1024:.0f} KB "
+          f"({ahorro:.0%} menos), {image.width}x{image.height}, {prepared.seconds * 1000:.0f} ms")
+    return prepared
+
+
+def para_modelo(image_bytes: bytes, model: str) -> PreparedImage:
+    return preparar_imagen(image_bytes, max_side=MODEL_INPUT_SIZES.get(model, DEFAULT_INPUT_SIZE))
+
+
+class AnalysisCache:
+    """Resultados de visión por (hash de la imagen preparada, modelo, prompt), con límite LRU."""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image_hash: str, model: str, prompt: str):
+        key = (image_hash, model, prompt)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        return None
+
+    def put(self, image_hash: str, model: str, prompt: str, result):
+        with self._lock:
+            self._entries[(image_hash, model, prompt)] = result
+            self._entries.move_to_end((image_hash, model, prompt))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Compartida entre sesiones: la misma foto subida dos veces no se analiza dos veces
+analysis_cache = AnalysisCache()
@@ -1,25 +1,45 @@
-def generar_imagen_sd(prompt, token):
-    import requests
-    import io
-    from PIL import Image
-    import base64
+from metrics import instrumentado
+
+FLUX_MODEL = "black-forest-labs/FLUX.1-dev"
+SD_MODEL = "stabilityai/stable-diffusion-2"
+
+
+@instrumentado("generar_imagen_flux")
+def generar_imagen_flux_bytes(prompt, token, cancel_event=None):
+    import hf_transport
+
+    payload = {"inputs": prompt}  # 👈 aquí está el cambio importante
+    response = hf_transport.post(FLUX_MODEL, token=token, json=payload, cancel_event=cancel_event)
+    if response.status_code != 200:
+        raise Exception(f"Error en la API: {response.status_code} - {response.text}")
+    return response.content
+
+
+@instrumentado("generar_imagen_sd")
+def generar_imagen_sd_bytes(prompt, token, cancel_event=None):
+    import hf_transport
 
-    url = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-2"
     headers = {
-        "Authorization": f"Bearer {token}",
         "Accept": "application/json"
     }
     payload = {
         "inputs": prompt,
     }
 
-    response = requests.post(url, headers=headers, json=payload)
+    response = hf_transport.post(SD_MODEL, token=token, json=payload, headers=headers, cancel_event=cancel_event)
 
     if response.status_code == 200:
-        image_bytes = response.content
-        try:
-            return Image.open(io.BytesIO(image_bytes))
-        except Exception as e:
-            raise ValueError("No se pudo decodificar la imagen: " + str(e))
+        return response.content
     else:
         raise ValueError(f"No se pudo generar: {response.text}")
+
+
+def generar_imagen_sd(prompt, token):
+    import io
+    from PIL import Image
+
+    image_bytes = generar_imagen_sd_bytes(prompt, token)
+    try:
+        return Image.open(io.BytesIO(image_bytes))
+    except Exception as e:
+        raise ValueError("No se pudo decodificar la imagen: " + str(e))
@@ -0,0 +1,143 @@
+# intent_router.py
+import re
+import threading
+import time
+
+# Cada patrón lleva el idioma en que está escrito y tiene que cubrir el mensaje
+# entero: "qué hora es en Tokio" o "qué día es hoy en la historia" llevan un
+# calificativo que solo sabe responder el LLM. Las palabras sueltas ("fecha",
+# "date", "horas") también llevan el suyo: langdetect no sirve con una sola
+# palabra ("fecha" sale galés) y su primera llamada tarda ~350 ms
+_INTENTS = {
+    "date": [
+        ("es", r"(qu[eé]|cu[aá]l)\s+(d[ií]a|fecha)\s+(es|ser[aá])(\s+hoy)?|(cu[aá]l\s+es\s+)?la\s+fecha(\s+de\s+hoy)?|fecha"),
+        ("en", r"what\s+(day|date)\s+is\s+(it|today)(\s+today)?|what('?s|\s+is)\s+(the\s+date|today'?s\s+date)(\s+today)?|(today'?s\s+)?date"),
+        ("pt", r"(que|qual)\s+(dia|data)\s+[eé]\s+hoje|(qual\s+[eé]\s+)?a\s+data(\s+de\s+hoje)?|data"),
+    ],
+    "time": [
+        ("es", r"qu[eé]\s+hora\s+es(\s+ahora)?|me\s+(dices|das)\s+la\s+hora|hora"),
+        ("en", r"what\s+time\s+is\s+it(\s+now)?|what('?s|\s+is)\s+the\s+(current\s+)?time(\s+now)?|time"),
+        ("pt", r"que\s+horas\s+s[aã]o(\s+agora)?|horas"),
+    ],
+    "help": [
+        ("es", r"(c[oó]mo|d[oó]nde)\s+(genero|creo|hago|puedo\s+(generar|crear|hacer))\s+(una\s+)?im[aá]gen(es)?(\s+aqu[ií])?|c[oó]mo\s+cambio\s+(de|el)\s+modo"),
+        ("en", r"how\s+(do\s+i|can\s+i|to)\s+(generate|create|make)\s+(an?\s+)?(image|picture)s?(\s+here)?|how\s+do\s+i\s+change\s+(the\s+)?mode"),
+        ("pt", r"como\s+(gero|crio|fa[cç]o)\s+(uma\s+)?imagem(\s+aqui)?"),
+    ],
+}
+# Solo se admiten signos y una fórmula de cortesía alrededor de la pregunta
+_CORTESIA = r"(\W+(por\s+favor|please))?"
+_PATTERNS = [(intent, lang, re.compile(rf"^\W*({p}){_CORTESIA}\W*$", re.IGNORECASE))
+             for intent, pats in _INTENTS.items() for lang, p in pats]
+
+# Mensajes largos casi nunca son preguntas de fecha u hora
+MAX_PROMPT_CHARS = 120
+
+_HELP = {
+    "es": "Toca el botón ➕ debajo de la barra de chat y elige **Generar imágenes** para que cree una imagen a partir de tu texto, "
+          "o **¡Habla con Tigre!** para volver al chat. También puedes subir una foto con el recuadro 📷 y escribir qué quieres saber de ella.",
+    "en": "Tap the ➕ button below the chat bar and choose **Generar imágenes** to create an image from your text, "
+          "or **¡Habla con Tigre!** to go back to chatting. You can also upload a photo with the 📷 box and ask about it.",
+    "pt": "Toque no botão ➕ abaixo da barra de chat e escolha **Generar imágenes** para criar uma imagem a partir do seu texto, "
+          "ou **¡Habla con Tigre!** para voltar ao chat. Você também pode enviar uma foto pelo quadro 📷 e perguntar sobre ela.",
+}
+
+
+def _fecha(prompt, lang, tz):
+    from utils import get_formatted_date
+    return get_formatted_date(prompt, lang, tz)
+
+
+def _hora(prompt, lang, tz):
+    from utils import get_formatted_time
+    return get_formatted_time(prompt, lang, tz)
+
+
+def _ayuda(prompt, lang, tz):
+    return _HELP.get(lang, _HELP["es"])
+
+
+_HANDLERS = {"date": _fecha, "time": _hora, "help": _ayuda}
+# La fecha y la hora dependen de la zona del usuario; sin ella las responde el LLM
+_NEEDS_TZ = {"date", "time"}
+
+
+class IntentRouter:
+    """
+    Responde localmente, sin llamar al LLM, las preguntas deterministas
+    (fecha, hora, cómo usar los modos). Devuelve None si no hay coincidencia.
+    Buscar la intención cuesta decenas de microsegundos; la primera respuesta
+    de fecha u hora en cada idioma, ~40 ms más mientras Babel carga los datos
+    del locale, salvo que antes se llame a warmup().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"routed": 0, "hits": {k: 0 for k in _HANDLERS}, "route_seconds": 0.0}
+        self._llm_seconds = []  # duración de los turnos que sí fueron al LLM
+
+    def match(self, prompt: str):
+        """(intención, idioma) o None."""
+        if not prompt or len(prompt) > MAX_PROMPT_CHARS:
+            return None
+        for intent, lang, pattern in _PATTERNS:
+            if pattern.search(prompt):
+                return intent, lang
+        return None
+
+    def route(self, prompt: str, tz: str = None):
+        """
+        Respuesta local o None. `tz` es la zona horaria del navegador (p. ej.
+        "America/Managua"); sin ella no se responden fecha ni hora.
+        """
+        start = time.perf_counter()
+        found = self.match(prompt)
+        if found and found[0] in _NEEDS_TZ and not tz:
+            found = None
+        respuesta = None
+        if found:
+            intent, lang = found
+            respuesta = _HANDLERS[intent](prompt, lang, tz)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.counters["routed"] += 1
+            self.counters["route_seconds"] += elapsed
+            if found:
+                self.counters["hits"][found[0]] += 1
+        if found:
+            ahorro = self.avg_llm_seconds()
+            print(f"Intención '{found[0]}' resuelta localmente en {elapsed * 1000:.2f} ms"
+                  + (f" (~{ahorro:.1f}s de LLM ahorrados)" if ahorro else ""))
+        return respuesta
+
+    def warmup(self):
+        """Carga los datos de Babel de cada idioma, fuera del turno de un usuario."""
+        from utils import LOCALE_MAP, get_formatted_date, get_formatted_time
+        for lang in LOCALE_MAP:
+            get_formatted_date("", lang)
+            get_formatted_time("", lang)
+
+    def record_llm_latency(self, seconds: float):
+        with self._lock:
+            self._llm_seconds.append(seconds)
+            del self._llm_seconds[:-200]
+
+    def avg_llm_seconds(self) -> float:
+        with self._lock:
+            return sum(self._llm_seconds) / len(self._llm_seconds) if self._llm_seconds else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = sum(self.counters["hits"].values())
+            routed = self.counters["routed"]
+            return {
+                "routed": routed,
+                "hits": dict(self.counters["hits"]),
+                "hit_rate": hits / routed if routed else 0.0,
+                "avg_route_ms": self.counters["route_seconds"] / routed * 1000 if routed else 0.0,
+                "llm_seconds_saved": hits * (sum(self._llm_seconds) / len(self._llm_seconds) if self._llm_seconds else 0.0),
+            }
+
+
+# Compartido por todas las sesiones
+intent_router = IntentRouter()
@@ -0,0 +1,236 @@
+# metrics.py
+import bisect
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Puerto del exportador Prometheus ("0" lo desactiva) y fichero opcional de trazas JSONL
+METRICS_PORT = int(os.environ.get("HEX_METRICS_PORT", "9464"))
+# Solo local por defecto; "0.0.0.0" para que lo lea un Prometheus de otra máquina
+METRICS_HOST = os.environ.get("HEX_METRICS_HOST", "127.0.0.1")
+TRACE_FILE = os.environ.get("HEX_TRACE_FILE", "")
+
+# Segundos: desde un render de Streamlit hasta una imagen de FLUX
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = (1024, 16384, 131072, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """Histograma acumulativo de buckets fijos, como los de Prometheus."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    """Lo que se mide de una llamada; el código instrumentado puede completarlo."""
+
+    __slots__ = ("name", "start", "status", "bytes_sent", "bytes_received", "retries")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.status = "ok"
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+
+
+class Metrics:
+    """Registro en memoria de histogramas y contadores, con salida en formato Prometheus."""
+
+    def __init__(self, trace_file: str = TRACE_FILE):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (métrica, etiquetas) -> Histogram
+        self._counters = {}  # (métrica, etiquetas) -> valor
+        self._gauges = {}  # métrica -> función que devuelve el valor al exportar
+        self._local = threading.local()
+        self._trace = open(trace_file, "a", encoding="utf-8", buffering=1) if trace_file else None
+        self._trace_lock = threading.Lock()
+
+    def observe(self, metric: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def inc(self, metric: str, value: float = 1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, metric: str, fn):
+        """
+        Valor que se calcula al exportar: `fn()` devuelve un número o una lista
+        de (etiquetas, valor).
+        """
+        with self._lock:
+            self._gauges[metric] = fn
+
+    def current_span(self):
+        stack = getattr(self._local, "spans", None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name: str):
+        """Mide el bloque: duración, bytes, reintentos y estado ("error" si lanza)."""
+        span = Span(name)
+        stack = getattr(self._local, "spans", None)
+        if stack is None:
+            stack = self._local.spans = []
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = getattr(e, "metric_status", "error")
+            raise
+        finally:
+            # remove y no pop: un generador a medio consumir puede cerrarse más tarde
+            stack.remove(span)
+            self._finish(span, time.perf_counter() - span.start)
+
+    def _finish(self, span: Span, seconds: float):
+        self.observe("hex_call_duration_seconds", seconds, call=span.name, status=span.status)
+        self.inc("hex_calls_total", call=span.name, status=span.status)
+        if span.retries:
+            self.inc("hex_call_retries_total", span.retries, call=span.name)
+        if span.bytes_sent:
+            self.observe("hex_call_bytes", span.bytes_sent, BYTES_BUCKETS, call=span.name, direction="sent")
+        if span.bytes_received:
+            self.observe("hex_call_bytes", span.bytes_received, BYTES_BUCKETS, call=span.name, direction="received")
+        if self._trace is not None:
+            line = json.dumps({
+                "ts": time.time(), "call": span.name, "seconds": round(seconds, 6), "status": span.status,
+                "bytes_sent": span.bytes_sent, "bytes_received": span.bytes_received, "retries": span.retries,
+                "thread": threading.current_thread().name,
+            }) + "\n"
+            with self._trace_lock:
+                self._trace.write(line)
+
+    def render(self) -> str:
+        """Todas las métricas en el formato de texto de Prometheus."""
+        with self._lock:
+            histograms = [(k, list(h.counts), h.sum, h.count, h.buckets) for k, h in self._histograms.items()]
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+        lines, vistos = [], set()
+        for metric, fn in sorted(gauges, key=lambda g: g[0]):
+            try:
+                valores = fn()
+            except Exception as e:
+                print(f"No se pudo calcular {metric}: {e}")
+                continue
+            lines.append(f"# TYPE {metric} gauge")
+            if isinstance(valores, (int, float)):
+                valores = [({}, valores)]
+            for labels, value in valores:
+                lines.append(f"{metric}{_labels(tuple(sorted(labels.items())))} {value}")
+        for (metric, labels), value in sorted(counters):
+            if metric not in vistos:
+                vistos.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        for (metric, labels), counts, total, count, buckets in sorted(histograms, key=lambda h: h[0]):
+            if metric not in vistos:
+                vistos.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            acumulado = 0
+            for bound, n in zip(list(buckets) + ["+Inf"], counts):
+                acumulado += n
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', str(bound)),))} {acumulado}")
+            lines.append(f"{metric}_sum{_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+metrics = Metrics()
+
+
+def instrumentado(name: str = None):
+    """Decorador: cada llamada a la función se mide como un span con su nombre."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        if inspect.isgeneratorfunction(fn):
+            # Para las respuestas en streaming se mide hasta el último fragmento
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                with metrics.span(span_name):
+                    yield from fn(*args, **kwargs)
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def marcar_error():
+    """Para funciones que capturan sus errores y devuelven un mensaje en vez de lanzar."""
+    span = metrics.current_span()
+    if span is not None:
+        span.status = "error"
+
+
+def registrar_http(bytes_sent: int = 0, bytes_received: int = 0, retry: bool = False):
+    """Lo llama el transporte HTTP para que la llamada en curso sepa qué envió y recibió."""
+    span = metrics.current_span()
+    if span is not None:
+        span.bytes_sent += bytes_sent
+        span.bytes_received += bytes_received
+        span.retries += int(retry)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_exportador(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Sirve /metrics desde un hilo aparte. Devuelve el servidor, o None si no se pudo."""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"No se pudo abrir el puerto de métricas {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="hex-metrics", daemon=True).start()
+    print(f"Métricas en http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,146 @@
+# model_registry.py
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Presupuesto de RAM para modelos locales (MB). Se puede ajustar por entorno.
+DEFAULT_RAM_BUDGET_MB = int(os.environ.get("HEX_MODEL_RAM_BUDGET_MB", "8192"))
+
+
+def estimar_bytes(obj) -> int:
+    """
+    Estima la memoria residente de un modelo (o tupla de objetos) sumando
+    parámetros y buffers de los módulos de torch que contenga.
+    """
+    if isinstance(obj, (tuple, list)):
+        return sum(estimar_bytes(o) for o in obj)
+    total = 0
+    if hasattr(obj, "parameters"):
+        total += sum(p.numel() * p.element_size() for p in obj.parameters())
+    if hasattr(obj, "buffers"):
+        total += sum(b.numel() * b.element_size() for b in obj.buffers())
+    return total
+
+
+class ModelRegistry:
+    """
+    Registro de modelos locales que se cargan la primera vez que se usan,
+    se comparten entre sesiones y se expulsan por LRU al superar el presupuesto.
+    """
+
+    def __init__(self, ram_budget_mb: int = DEFAULT_RAM_BUDGET_MB):
+        self.ram_budget_bytes = ram_budget_mb * 1024 * 1024
+        self._loaders = {}
+        self._loaded = OrderedDict()  # nombre -> objeto, en orden de uso
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name: str, loader, size_hint_mb: int = 0):
+        """Registra un cargador sin ejecutarlo. `size_hint_mb` permite liberar RAM antes de cargar."""
+        self._loaders[name] = (loader, size_hint_mb * 1024 * 1024)
+        self._load_locks[name] = threading.Lock()
+
+    def get(self, name: str):
+        """Devuelve el modelo, cargándolo si hace falta."""
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                self._stats[name]["hits"] += 1
+                return self._loaded[name]
+        if name not in self._loaders:
+            raise KeyError(f"Modelo no registrado: {name}")
+
+        # Un lock por modelo evita que dos sesiones carguen el mismo modelo a la vez
+        with self._load_locks[name]:
+            with self._lock:
+                if name in self._loaded:
+                    self._loaded.move_to_end(name)
+                    self._stats[name]["hits"] += 1
+                    return self._loaded[name]
+            loader, size_hint = self._loaders[name]
+            with self._lock:
+                self._evict_until(self.ram_budget_bytes - size_hint)
+
+            start = time.perf_counter()
+            obj = loader()
+            load_seconds = time.perf_counter() - start
+            size = estimar_bytes(obj) or size_hint
+
+            with self._lock:
+                self._loaded[name] = obj
+                self._stats[name] = {
+                    "load_seconds": load_seconds,
+                    "resident_bytes": size,
+                    "hits": 0,
+                    "loaded_at": time.time(),
+                }
+                self._evict_until(self.ram_budget_bytes, keep=name)
+            print(f"[modelos] '{name}' cargado en {load_seconds:.1f}s ({size / 1024**2:.0f} MB)")
+            return obj
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._loaded
+
+    def unload(self, name: str):
+        with self._lock:
+            self._drop(name)
+
+    def resident_bytes(self) -> int:
+        return sum(self._stats[n]["resident_bytes"] for n in self._loaded)
+
+    def stats(self) -> dict:
+        """Tiempo de carga, tamaño residente y usos de cada modelo cargado."""
+        with self._lock:
+            return {n: dict(self._stats[n]) for n in self._loaded}
+
+    def _evict_until(self, limit_bytes: int, keep: str = None):
+        # Se llama con self._lock tomado
+        for name in list(self._loaded):
+            if self.resident_bytes() <= max(limit_bytes, 0):
+                break
+            if name != keep:
+                self._drop(name)
+        if keep and self.resident_bytes() > self.ram_budget_bytes:
+            print(f"[modelos] '{keep}' supera por sí solo el presupuesto de {self.ram_budget_bytes / 1024**2:.0f} MB")
+
+    def _drop(self, name: str):
+        if self._loaded.pop(name, None) is not None:
+            print(f"[modelos] expulsando '{name}' ({self._stats[name]['resident_bytes'] / 1024**2:.0f} MB)")
+            self._stats.pop(name, None)
+            gc.collect()
+
+
+def _cargar_trocr():
+    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+    processor = TrOCRProcessor.from_pretrained("microsoft/trocr-base-handwritten")
+    model = VisionEncoderDecoderModel.from_pretrained("microsoft/trocr-base-handwritten")
+    model.eval()
+    return processor, model
+
+
+def _cargar_trocr_int8():
+    import torch
+    # Carga propia, no registry.get("trocr"), y cuantización en el lugar: las capas
+    # lineales fp32 se reemplazan por int8 y el modelo fp32 no queda residente
+    processor, model = _cargar_trocr()
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return processor, model
+
+
+def _cargar_llava():
+    from transformers import AutoProcessor, AutoModelForVision2Seq
+    processor = AutoProcessor.from_pretrained("llava-hf/llava-1.5-7b-hf")
+    model = AutoModelForVision2Seq.from_pretrained("llava-hf/llava-1.5-7b-hf")
+    model.eval()
+    return processor, model
+
+
+# Instancia única por proceso: Streamlit importa el módulo una sola vez,
+# así que todas las sesiones comparten los modelos ya cargados.
+registry = ModelRegistry()
+registry.register("trocr", _cargar_trocr, size_hint_mb=1400)
+registry.register("trocr-int8", _cargar_trocr_int8, size_hint_mb=400)
+registry.register("llava", _cargar_llava, size_hint_mb=28000)
@@ -0,0 +1,108 @@
+# ocr_engine.py
+import io
+import os
+import threading
+import time
+
+from model_registry import registry, estimar_bytes
+
+# Hilos de torch para la inferencia local de OCR
+OCR_THREADS = int(os.environ.get("HEX_OCR_THREADS", str(max(1, (os.cpu_count() or 2) // 2))))
+BATCH_SIZE = int(os.environ.get("HEX_OCR_BATCH", "8"))
+# Filas con menos tinta que esta fracción del máximo (medida sobre el fondo) se
+# consideran espacio entre líneas
+LINE_THRESHOLD = 0.02
+# Percentil del perfil que se toma como fondo: papel gris, sombras o rayado
+BACKGROUND_PERCENTILE = 0.1
+MIN_LINE_HEIGHT = 12
+
+# torch.set_num_threads es global al proceso: las inferencias se hacen de a una
+_inference_lock = threading.Lock()
+# Aparte del de inferencia: pedir el motor no espera a que termine otra transcripción
+_load_lock = threading.Lock()
+
+
+def segmentar_lineas(image, threshold: float = LINE_THRESHOLD, min_height: int = MIN_LINE_HEIGHT):
+    """
+    Divide una página en recortes de una línea con el perfil de proyección
+    horizontal: se suma la tinta de cada fila y se corta donde no hay. Antes se
+    resta el nivel de fondo, para que una foto con papel oscuro o sombra no
+    parezca tinta en todas las filas.
+    """
+    from PIL import Image, ImageOps
+
+    ancho, alto = image.size
+    # Tinta = 255 - brillo; el filtro BOX a una sola columna da la media de cada fila
+    columna = ImageOps.invert(ImageOps.grayscale(image)).resize((1, alto), Image.BOX)
+    tinta = list(columna.getdata())
+    fondo = sorted(tinta)[int(len(tinta) * BACKGROUND_PERCENTILE)]
+    tinta = [max(0, v - fondo) for v in tinta]
+    pico = max(tinta) or 1
+
+    lineas, inicio = [], None
+    for y, valor in enumerate(tinta + [0]):
+        if valor / pico > threshold:
+            if inicio is None:
+                inicio = y
+        elif inicio is not None:
+            if y - inicio >= min_height:
+                margen = max(2, (y - inicio) // 8)
+                lineas.append(image.crop((0, max(0, inicio - margen), ancho, min(alto, y + margen))))
+            inicio = None
+    # Sin líneas claras (foto de una sola línea, fondo irregular): la página entera
+    return lineas or [image]
+
+
+class OCREngine:
+    """
+    OCR local de texto manuscrito con TrOCR: recorta la página en líneas y las
+    procesa por lotes con `generate`. `quantized=True` usa la variante int8.
+    """
+
+    def __init__(self, quantized: bool = False, threads: int = OCR_THREADS, batch_size: int = BATCH_SIZE):
+        self.model_name = "trocr-int8" if quantized else "trocr"
+        self.threads = threads
+        self.batch_size = batch_size
+
+    def transcribir(self, image_bytes: bytes, stats: dict = None) -> str:
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        lineas = segmentar_lineas(image)
+        textos = self.transcribir_lineas(lineas, stats)
+        return "\n".join(t for t in textos if t.strip())
+
+    def transcribir_lineas(self, lineas: list, stats: dict = None) -> list:
+        import torch
+
+        processor, model = registry.get(self.model_name)
+        start = time.perf_counter()
+        textos = []
+        with _inference_lock, torch.inference_mode():
+            # Se devuelve el valor anterior al terminar: el resto del proceso no cambia
+            hilos_previos = torch.get_num_threads()
+            torch.set_num_threads(self.threads)
+            try:
+                for i in range(0, len(lineas), self.batch_size):
+                    lote = lineas[i:i + self.batch_size]
+                    pixel_values = processor(images=lote, return_tensors="pt").pixel_values
+                    ids = model.generate(pixel_values, max_new_tokens=64)
+                    textos.extend(processor.batch_decode(ids, skip_special_tokens=True))
+            finally:
+                torch.set_num_threads(hilos_previos)
+        elapsed = time.perf_counter() - start
+        if stats is not None:
+            stats.update(lines=len(lineas), seconds=elapsed,
+                         lines_per_s=len(lineas) / elapsed if elapsed else 0.0,
+                         model=self.model_name, resident_bytes=estimar_bytes(model))
+        return textos
+
+
+_engines = {}
+
+
+def get_ocr_engine(quantized: bool = os.environ.get("HEX_OCR_INT8", "0") == "1") -> OCREngine:
+    with _load_lock:
+        if quantized not in _engines:
+            _engines[quantized] = OCREngine(quantized=quantized)
+        return _engines[quantized]
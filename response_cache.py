@@ -0,0 +1,139 @@
+# response_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = float(os.environ.get("HEX_RESPONSE_CACHE_TTL", "86400"))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("HEX_RESPONSE_CACHE_SIZE", "1000"))
+# Si se define, la caché se comparte entre procesos mediante este archivo SQLite
+DEFAULT_DB_PATH = os.environ.get("HEX_RESPONSE_CACHE_DB") or None
+
+
+def normalize_key(text: str) -> str:
+    """
+    Minúsculas y espacios colapsados, sin tocar signos: para claves de caché,
+    donde "2+2" y "2-2" o "C++" y "C#" tienen que seguir siendo distintos.
+    """
+    return " ".join((text or "").casefold().split())
+
+
+def is_cacheable(chat_history, **params) -> bool:
+    """
+    Solo se cachean turnos sin historial previo, para que una respuesta nunca
+    se reutilice en otra conversación con contexto, y solo si se pidió
+    explícitamente decodificación determinista (temperature=0): con el
+    muestreo por defecto del servidor cada respuesta es distinta.
+    """
+    if chat_history:
+        return False
+    return params.get("temperature") == 0
+
+
+def _key(*parts) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caché de respuestas de chat_completion con TTL y límite LRU. Busca primero
+    por el prompt exacto y luego por el prompt normalizado.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES, db_path: str = DEFAULT_DB_PATH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._memory = OrderedDict()  # clave -> (creado, respuesta)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "normalized_hits": 0, "misses": 0, "stores": 0}
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def keys(self, model: str, system_prompt: str, prompt: str):
+        exact = _key("exact", model, system_prompt, prompt)
+        normalized = _key("fold", model, normalize_key(system_prompt), normalize_key(prompt))
+        return exact, normalized
+
+    def get(self, model: str, system_prompt: str, prompt: str):
+        exact, normalized = self.keys(model, system_prompt, prompt)
+        for key, counter in ((exact, "hits"), (normalized, "normalized_hits")):
+            response = self._lookup(key)
+            if response is not None:
+                with self._lock:
+                    self.counters[counter] += 1
+                return response
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def set(self, model: str, system_prompt: str, prompt: str, response: str):
+        now = time.time()
+        with self._lock:
+            for key in self.keys(model, system_prompt, prompt):
+                self._memory[key] = (now, response)
+                self._memory.move_to_end(key)
+                if self._db is not None:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO response_cache (key, response, created, last_used) VALUES (?, ?, ?, ?)",
+                        (key, response, now, now),
+                    )
+            self._trim()
+            if self._db is not None:
+                self._db.execute(
+                    "DELETE FROM response_cache WHERE created < ? OR key NOT IN "
+                    "(SELECT key FROM response_cache ORDER BY last_used DESC LIMIT ?)",
+                    (now - self.ttl, self.max_entries),
+                )
+                self._db.commit()
+            self.counters["stores"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._memory)
+        lookups = stats["hits"] + stats["normalized_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["normalized_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM response_cache")
+                self._db.commit()
+
+    def _lookup(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    return entry[1]
+                del self._memory[key]
+            if self._db is None:
+                return None
+            # Otro proceso pudo haberla guardado
+            row = self._db.execute(
+                "SELECT response, created FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                return None
+            self._db.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._memory[key] = (row[1], row[0])
+            self._trim()
+            return row[0]
+
+    def _trim(self):
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,228 @@
+# retrieval.py
+import codecs
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+
+from utils import normalize_text
+
+# Límites de descarga por página y plazo global para todas
+MAX_PAGE_BYTES = int(os.environ.get("HEX_FETCH_MAX_BYTES", str(1024 * 1024)))
+FETCH_TIMEOUT = (3, 5)
+FETCH_DEADLINE = float(os.environ.get("HEX_FETCH_DEADLINE", "6"))
+PAGE_TTL = float(os.environ.get("HEX_PAGE_TTL", "3600"))
+PAGE_CACHE_SIZE = 256
+# Tamaño de los fragmentos en palabras y solapamiento entre fragmentos consecutivos
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 30
+# Tokens que puede ocupar el contexto recuperado dentro del prompt
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("HEX_RETRIEVAL_TOKEN_BUDGET", "800"))
+
+_STOPWORDS = set("""
+a al algo como con de del donde el ella en era es esa ese esta este fue ha hay la las le lo los mas me mi muy no o para pero por que se si sin sobre su sus te tu un una uno y ya
+the of and to in is it that for on with as was at by an be this are or from
+""".split())
+
+# <meta charset="..."> o <meta http-equiv="Content-Type" content="text/html; charset=...">
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE)
+_HEADER_CHARSET = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+
+_SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "iframe", "button"}
+_BLOCK_TAGS = {"p", "div", "li", "br", "h1", "h2", "h3", "h4", "h5", "h6", "tr", "article", "section", "blockquote", "pre"}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS and self._skip:
+            self._skip -= 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def extraer_texto(html: str, min_chars: int = 40) -> str:
+    """Texto principal de una página: sin scripts ni menús, solo bloques con frases."""
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass
+    bloques = (" ".join(b.split()) for b in "".join(parser.parts).split("\n"))
+    return "\n".join(b for b in bloques if len(b) >= min_chars)
+
+
+def _codec_valido(nombre):
+    try:
+        return codecs.lookup(nombre.decode("ascii") if isinstance(nombre, bytes) else nombre).name
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
+def detectar_charset(tipo: str, contenido: bytes) -> str:
+    """
+    Codificación de una página: la del Content-Type si la declara, si no la del
+    <meta> del HTML, si no UTF-8 cuando decodifica limpio y, como último
+    recurso, la que detecte charset_normalizer/chardet. No se usa el
+    ISO-8859-1 que requests supone para text/* sin charset.
+    """
+    for match in (_HEADER_CHARSET.search(tipo), _META_CHARSET.search(contenido[:4096])):
+        codec = match and _codec_valido(match.group(1))
+        if codec:
+            return codec
+    try:
+        contenido.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        if e.start >= len(contenido) - 3:
+            return "utf-8"  # solo el último carácter quedó cortado por el límite de bytes
+    from requests.compat import chardet
+    detectado = chardet.detect(contenido).get("encoding") if chardet else None
+    return _codec_valido(detectado) if detectado else "utf-8"
+
+
+def tokenizar(texto: str) -> list:
+    return [t for t in normalize_text(texto).split() if t not in _STOPWORDS and len(t) > 1]
+
+
+def fragmentar(texto: str, words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> list:
+    palabras = texto.split()
+    if len(palabras) <= words:
+        return [texto] if palabras else []
+    paso = words - overlap
+    return [" ".join(palabras[i:i + words]) for i in range(0, len(palabras) - overlap, paso)]
+
+
+class BM25:
+    """Índice BM25 en memoria sobre una lista de fragmentos."""
+
+    def __init__(self, docs: list, k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.docs = [Counter(tokenizar(d)) for d in docs]
+        self.lengths = [sum(d.values()) for d in self.docs]
+        self.avg_len = sum(self.lengths) / len(self.docs) if self.docs else 0
+        df = Counter(t for d in self.docs for t in d)
+        n = len(self.docs)
+        self.idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+
+    def scores(self, query: str) -> list:
+        terms = tokenizar(query)
+        resultado = []
+        for doc, length in zip(self.docs, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_len or 1))
+            for t in terms:
+                f = doc.get(t)
+                if f:
+                    score += self.idf[t] * f * (self.k1 + 1) / (f + norm)
+            resultado.append(score)
+        return resultado
+
+
+class PageFetcher:
+    """Descarga páginas en paralelo con límites de tamaño y tiempo, y guarda el texto extraído."""
+
+    def __init__(self, ttl: float = PAGE_TTL, max_entries: int = PAGE_CACHE_SIZE, max_workers: int = 6):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # url -> (creado, texto)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hex-fetch")
+
+    def fetch(self, url: str) -> str:
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._cache.move_to_end(url)
+                return entry[1]
+
+        try:
+            texto = self._descargar(url)
+        except Exception as e:
+            # Un fallo (timeout, 5xx) puede ser pasajero: no se guarda en caché
+            print(f"No se pudo leer {url}: {e}")
+            return ""
+        with self._lock:
+            self._cache[url] = (now, texto)
+            self._cache.move_to_end(url)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return texto
+
+    def fetch_many(self, urls: list, deadline: float = FETCH_DEADLINE) -> dict:
+        """{url: texto} de las páginas que llegaron antes del plazo."""
+        futures = {self._executor.submit(self.fetch, url): url for url in urls}
+        done, _ = wait(futures, timeout=deadline)
+        return {futures[f]: f.result() for f in done if f.result()}
+
+    def _descargar(self, url: str) -> str:
+        import hf_transport
+
+        start = time.perf_counter()
+        with hf_transport.get_session().get(url, timeout=FETCH_TIMEOUT, stream=True,
+                                            headers={"User-Agent": "Mozilla/5.0 (HEX T 1.0)"}) as response:
+            response.raise_for_status()
+            tipo = response.headers.get("Content-Type", "")
+            if "html" not in tipo and "text/plain" not in tipo:
+                return ""
+            partes, total = [], 0
+            for chunk in response.iter_content(chunk_size=16384):
+                partes.append(chunk)
+                total += len(chunk)
+                if total >= MAX_PAGE_BYTES or time.perf_counter() - start > sum(FETCH_TIMEOUT):
+                    break
+            contenido = b"".join(partes)[:MAX_PAGE_BYTES]
+            contenido = contenido.decode(detectar_charset(tipo, contenido) or "utf-8", errors="replace")
+        return contenido if "text/plain" in tipo else extraer_texto(contenido)
+
+
+def recuperar_pasajes(query: str, results: list, top_k: int = 4, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                      fetcher: "PageFetcher" = None) -> list:
+    """
+    Lee las páginas de los resultados, las divide en fragmentos y devuelve los
+    más relevantes para la consulta que quepan en el presupuesto de tokens.
+    """
+    from context_builder import count_tokens
+
+    fetcher = fetcher or page_fetcher
+    paginas = fetcher.fetch_many([r["url"] for r in results])
+    fragmentos = [(url, f) for url, texto in paginas.items() for f in fragmentar(texto)]
+    if not fragmentos:
+        return []
+
+    scores = BM25([f for _, f in fragmentos]).scores(query)
+    ranking = sorted(zip(scores, fragmentos), key=lambda x: -x[0])
+    pasajes, usados = [], 0
+    for score, (url, texto) in ranking:
+        if score <= 0 or len(pasajes) >= top_k:
+            break
+        tokens = count_tokens(texto)
+        if usados + tokens > token_budget:
+            continue
+        usados += tokens
+        pasajes.append({"text": texto, "url": url, "score": score})
+    return pasajes
+
+
+# Compartido por todas las sesiones: cada página se descarga una vez por TTL
+page_fetcher = PageFetcher()
@@ -0,0 +1,157 @@
+# search_service.py
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from metrics import marcar_error
+from response_cache import normalize_key
+from retrieval import recuperar_pasajes
+from utils import normalize_text
+
+SEARCH_TTL = float(os.environ.get("HEX_SEARCH_TTL", "900"))
+SEARCH_CACHE_SIZE = int(os.environ.get("HEX_SEARCH_CACHE_SIZE", "512"))
+# Tiempo máximo para todas las búsquedas de una pregunta; lo que no llegue se descarta
+SEARCH_DEADLINE = float(os.environ.get("HEX_SEARCH_DEADLINE", "4"))
+# Una búsqueda descartada por el plazo sigue ocupando su hilo hasta este timeout HTTP
+SEARCH_TIMEOUT = int(os.environ.get("HEX_SEARCH_TIMEOUT", "5"))
+# Holgura para que las búsquedas atrasadas no hagan esperar a las preguntas nuevas
+SEARCH_WORKERS = int(os.environ.get("HEX_SEARCH_WORKERS", "8"))
+
+_PREGUNTA = re.compile(r"^\s*[¿¡]?\s*(qu[eé]|cu[aá]l(es)?|c[oó]mo|d[oó]nde|cu[aá]ndo|qui[eé]n(es)?|what|which|how|where|when|who)\s+(es|son|est[aá]|fue|is|are|was)?\s*", re.IGNORECASE)
+
+
+def reformular(query: str) -> list:
+    """Variantes de la consulta: la original y una versión solo con palabras clave."""
+    consultas = [query.strip()]
+    clave = _PREGUNTA.sub("", query).strip(" ¿?¡!.")
+    if clave and normalize_text(clave) != normalize_text(query):
+        consultas.append(clave)
+    return consultas
+
+
+class SearchService:
+    """
+    Búsquedas en DuckDuckGo con caché TTL/LRU por (consulta, región, periodo),
+    varias consultas en paralelo con un plazo global y resultados sin URLs repetidas.
+    """
+
+    def __init__(self, ttl: float = SEARCH_TTL, max_entries: int = SEARCH_CACHE_SIZE, max_workers: int = SEARCH_WORKERS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # clave -> (creado, resultados)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hex-search")
+        self.counters = {"hits": 0, "misses": 0, "errors": 0, "timeouts": 0}
+
+    def _ddgs(self):
+        # Un cliente por hilo, reutilizado entre búsquedas
+        if getattr(self._local, "ddgs", None) is None:
+            from duckduckgo_search import DDGS
+            self._local.ddgs = DDGS(timeout=SEARCH_TIMEOUT)
+        return self._local.ddgs
+
+    def search(self, query: str, region: str = "wt-wt", timelimit: str = "y", max_results: int = 3) -> list:
+        # Los signos cuentan: "c++", "c#" y "c" son búsquedas distintas
+        key = (normalize_key(query), region, timelimit, max_results)
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._cache.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[1]
+            self.counters["misses"] += 1
+
+        print(f"🔎 Realizando búsqueda web para: '{query}'")
+        results = [
+            {"snippet": r["body"], "url": r["href"], "title": r.get("title", "")}
+            for r in self._ddgs().text(query, region=region, safesearch="off", timelimit=timelimit, max_results=max_results)
+        ]
+        with self._lock:
+            self._cache[key] = (now, results)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return results
+
+    def search_many(self, queries: list, deadline: float = SEARCH_DEADLINE, **kwargs) -> list:
+        """
+        Lanza las consultas en paralelo y junta lo que haya llegado antes del
+        plazo, en el orden de las consultas y sin URLs repetidas.
+        """
+        futures = [self._executor.submit(self.search, q, **kwargs) for q in queries]
+        done, pending = wait(futures, timeout=deadline)
+        if pending:
+            # Las que aún no empezaron no llegan a ocupar un hilo
+            for future in pending:
+                future.cancel()
+            with self._lock:
+                self.counters["timeouts"] += len(pending)
+        errores = []
+        results, vistas = [], set()
+        for future in futures:
+            if future not in done:
+                continue
+            try:
+                encontrados = future.result()
+            except Exception as e:
+                errores.append(e)
+                continue
+            for r in encontrados:
+                url = r["url"].split("#")[0].rstrip("/")
+                if url not in vistas:
+                    vistas.add(url)
+                    results.append(r)
+        if errores:
+            with self._lock:
+                self.counters["errors"] += len(errores)
+            if not results:
+                raise errores[0]
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, entries=len(self._cache))
+
+
+def buscar_contexto(query: str, timelimit: str = "y"):
+    """
+    Busca en la web y devuelve el contexto para la IA y la lista de fuentes:
+    los pasajes más relevantes de las páginas, o los snippets del buscador si
+    no se pudo leer ninguna.
+    """
+    try:
+        results = search_service.search_many(reformular(query), timelimit=timelimit, max_results=3)
+        if not results:
+            return "No se encontraron resultados relevantes.", []
+        pasajes = recuperar_pasajes(query, results)
+        if pasajes:
+            return build_passage_context(pasajes, results)
+        return build_context(results)
+    except Exception as e:
+        marcar_error()
+        print(f"Error en la búsqueda web: {e}")
+        return "Ocurrió un error al intentar buscar en la web.", []
+
+
+def build_context(results: list, max_sources: int = 3):
+    """Texto de contexto para la IA ("Fuente N: ...") y la lista de fuentes."""
+    sources = [{"snippet": r["snippet"], "url": r["url"]} for r in results[:max_sources]]
+    context_text = "\n\n".join([f"Fuente {i+1}: {r['snippet']}" for i, r in enumerate(sources)])
+    return context_text, sources
+
+
+def build_passage_context(pasajes: list, results: list):
+    """Igual que build_context, pero con los pasajes recuperados de las páginas."""
+    context_text = "\n\n".join([f"Fuente {i+1} ({p['url']}): {p['text']}" for i, p in enumerate(pasajes)])
+    urls = {p["url"] for p in pasajes}
+    sources = [{"snippet": r["snippet"], "url": r["url"]} for r in results if r["url"] in urls]
+    return context_text, sources
+
+
+# Compartido por todas las sesiones: las búsquedas populares salen de la caché
+search_service = SearchService()
@@ -0,0 +1,233 @@
+# session_governor.py
+import os
+import sys
+import threading
+import time
+
+# Límites aproximados del estado de sesión en memoria, por sesión y en total
+SESSION_LIMIT = int(float(os.environ.get("HEX_SESSION_MAX_MB", "8")) * 1024 * 1024)
+GLOBAL_LIMIT = int(float(os.environ.get("HEX_SESSIONS_MAX_MB", "256")) * 1024 * 1024)
+# Sesiones sin actividad durante este tiempo se vacían (sus chats siguen en SQLite)
+IDLE_TIMEOUT = float(os.environ.get("HEX_SESSION_IDLE_S", "1800"))
+SWEEP_INTERVAL = 60.0
+# A otra sesión solo se le descarga estado si lleva este tiempo sin ejecutarse
+GRACE_SECONDS = 30.0
+# Mensajes del chat abierto que se conservan al descargar por tamaño
+KEEP_MESSAGES = 30
+
+
+def estimar_bytes(value, depth: int = 0) -> int:
+    """Tamaño aproximado de un valor de session_state, sin recorrerlo más de 4 niveles."""
+    if isinstance(value, (str, bytes, bytearray)):
+        return sys.getsizeof(value)
+    size = getattr(value, "size", None)  # UploadedFile
+    if isinstance(size, int):
+        return size
+    if depth >= 4:
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimar_bytes(k, depth + 1) + estimar_bytes(v, depth + 1)
+                                          for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimar_bytes(v, depth + 1) for v in value)
+    return sys.getsizeof(value)
+
+
+def _get(state, key, default=None):
+    return state[key] if key in state else default
+
+
+def _estado_raiz(state):
+    # SafeSessionState se crea de nuevo en cada ejecución; el SessionState de
+    # debajo es el mismo durante toda la vida de la sesión
+    return getattr(state, "_state", state)
+
+
+def _sesion_activa(session_id: str) -> bool:
+    """False si Streamlit ya cerró la sesión; fuera del servidor (AppTest) siempre True."""
+    try:
+        from streamlit.runtime import Runtime
+        if not Runtime.exists():
+            return True
+        return Runtime.instance().is_active_session(session_id)
+    except Exception:
+        return True
+
+
+def descargar_mensajes(state, keep: int) -> int:
+    """
+    Deja en memoria solo los últimos `keep` mensajes del chat abierto; el resto
+    ya está en SQLite y la app lo vuelve a leer si hace falta. Devuelve cuántos quitó.
+    """
+    messages = _get(state, "active_messages") or []
+    quitar = len(messages) - keep
+    if quitar <= 0:
+        return 0
+    state["active_messages"] = messages[quitar:]
+    state["mensajes_omitidos"] = (_get(state, "mensajes_omitidos") or 0) + quitar
+    return quitar
+
+
+class _Sesion:
+    __slots__ = ("state", "thread", "bytes", "messages", "last_seen", "offloaded", "evicted", "trim_pending")
+
+    def __init__(self, state):
+        self.state = state  # SessionState de la sesión; se suelta cuando Streamlit la cierra
+        self.thread = None  # hilo de la última ejecución del script
+        self.bytes = 0
+        self.messages = 0
+        self.last_seen = time.time()
+        self.offloaded = 0
+        self.evicted = False
+        self.trim_pending = False
+
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+
+class SessionGovernor:
+    """
+    Lleva la cuenta del tamaño aproximado del estado de cada sesión y lo mantiene
+    bajo los límites descargando los mensajes antiguos del chat abierto (que ya
+    están en SQLite). Las sesiones inactivas se vacían por completo.
+
+    El estado de otra sesión solo se toca desde fuera si su script no está
+    corriendo; si lo está, se le deja marcado y se recorta sola en su próximo touch().
+    """
+
+    def __init__(self, session_limit: int = SESSION_LIMIT, global_limit: int = GLOBAL_LIMIT,
+                 idle_timeout: float = IDLE_TIMEOUT, keep_messages: int = KEEP_MESSAGES):
+        self.session_limit = session_limit
+        self.global_limit = global_limit
+        self.idle_timeout = idle_timeout
+        self.keep_messages = keep_messages
+        self._sessions = {}  # session_id -> _Sesion
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.counters = {"offloaded_messages": 0, "offloads": 0, "idle_evictions": 0}
+
+    def touch(self, session_id: str, state) -> int:
+        """
+        Se llama en cada ejecución del script, desde el hilo de la propia sesión.
+        Mide su estado, aplica los límites y devuelve los bytes estimados.
+        """
+        raiz = _estado_raiz(state)
+        with self._lock:
+            sesion = self._sessions.get(session_id)
+            if sesion is None or sesion.state is not raiz:
+                sesion = self._sessions[session_id] = _Sesion(raiz)
+            sesion.thread = threading.current_thread()
+            sesion.last_seen = time.time()
+            sesion.evicted = False
+            recortar, sesion.trim_pending = sesion.trim_pending, False
+        self._medir(sesion, state)
+        if recortar or sesion.bytes > self.session_limit:
+            self._descargar(sesion, state)
+        if self.total_bytes() > self.global_limit:
+            self._liberar_global(session_id)
+        return sesion.bytes
+
+    def _medir(self, sesion, state):
+        # SafeSessionState de Streamlit expone las claves del usuario en filtered_state
+        valores = state.filtered_state if hasattr(state, "filtered_state") else dict(state)
+        sesion.bytes = sum(estimar_bytes(v) for v in valores.values())
+        sesion.messages = len(_get(state, "active_messages") or [])
+
+    def _descargar(self, sesion, state, keep: int = None):
+        quitados = descargar_mensajes(state, self.keep_messages if keep is None else keep)
+        if quitados:
+            sesion.offloaded += quitados
+            with self._lock:
+                self.counters["offloads"] += 1
+                self.counters["offloaded_messages"] += quitados
+            self._medir(sesion, state)
+        return quitados
+
+    def _liberar_global(self, actual: str):
+        # Primero las sesiones que llevan más tiempo sin usarse; la actual, la última
+        limite = time.time() - GRACE_SECONDS
+        with self._lock:
+            candidatas = sorted(
+                ((s.last_seen, sid, s) for sid, s in self._sessions.items() if sid != actual and s.last_seen < limite),
+                key=lambda c: c[0],
+            )
+            candidatas.append((0, actual, self._sessions.get(actual)))
+        for _, sid, sesion in candidatas:
+            if sesion is None:
+                continue
+            if sid != actual and not self._reservar(sesion):
+                continue  # corriendo: se recorta sola en su próximo touch()
+            self._descargar(sesion, sesion.state)
+            if self.total_bytes() <= self.global_limit:
+                return
+
+    def _reservar(self, sesion) -> bool:
+        """True si se puede tocar el estado de otra sesión; si está corriendo, la marca."""
+        with self._lock:
+            if sesion.running():
+                sesion.trim_pending = True
+                return False
+            return True
+
+    def sweep(self):
+        """Vacía las sesiones inactivas y olvida las que Streamlit ya cerró."""
+        ahora = time.time()
+        with self._lock:
+            sesiones = list(self._sessions.items())
+        for sid, sesion in sesiones:
+            if not _sesion_activa(sid):
+                with self._lock:
+                    self._sessions.pop(sid, None)
+                continue
+            if sesion.evicted or ahora - sesion.last_seen < self.idle_timeout:
+                continue
+            if not self._reservar(sesion):
+                continue
+            state = sesion.state
+            self._descargar(sesion, state, keep=0)
+            if _get(state, "imagen_cargada") is not None:
+                # Con otra key el uploader suelta el archivo que tenía en memoria
+                state["imagen_cargada"] = None
+                state["uploader_key"] = (_get(state, "uploader_key") or 0) + 1
+            self._medir(sesion, state)
+            sesion.evicted = True
+            with self._lock:
+                self.counters["idle_evictions"] += 1
+
+    def start_sweeper(self, interval: float = SWEEP_INTERVAL):
+        if self._sweeper is None:
+            def loop():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.sweep()
+                    except Exception as e:
+                        print(f"Falló la limpieza de sesiones: {e}")
+            self._sweeper = threading.Thread(target=loop, name="hex-session-sweeper", daemon=True)
+            self._sweeper.start()
+        return self._sweeper
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(s.bytes for s in self._sessions.values())
+
+    def usage(self) -> list:
+        """Uso actual por sesión, de mayor a menor."""
+        ahora = time.time()
+        with self._lock:
+            filas = [{"session": sid, "bytes": s.bytes, "messages": s.messages,
+                      "idle_s": round(ahora - s.last_seen, 1), "offloaded_messages": s.offloaded,
+                      "evicted": s.evicted}
+                     for sid, s in self._sessions.items()]
+        return sorted(filas, key=lambda f: -f["bytes"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            sesiones = len(self._sessions)
+            counters = dict(self.counters)
+        return dict(counters, sessions=sesiones, bytes=self.total_bytes(),
+                    session_limit=self.session_limit, global_limit=self.global_limit)
+
+
+# Uno por proceso: los límites son de todo el servidor
+session_governor = SessionGovernor()
@@ -1,44 +1,104 @@
 import streamlit as st
-from huggingface_hub import InferenceClient
+import os
+import re
+import threading
 import time
-import random
-from PIL import Image
-import requests, base64, io
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-from transformers import AutoProcessor, AutoModelForVision2Seq
+import uuid
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+# torch, transformers y PIL se importan dentro de las funciones que los usan:
+# el chat de texto no los necesita y solo alargan el arranque
+import hf_transport
+from model_registry import registry
+from context_builder import ContextBuilder
+from response_cache import ResponseCache, is_cacheable
+from image_jobs import job_queue, JobLimitError, PENDING, QUEUED, DONE, CANCELLED
+from blob_store import blob_store
+from chat_store import chat_store
+from vision_helper import analizar_imagen_con_llava
+from ocr_engine import get_ocr_engine
+from intent_router import intent_router
+from metrics import metrics, instrumentado, marcar_error, registrar_http, iniciar_exportador
+from session_governor import session_governor
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Con HEX_OCR_LOCAL=1 los pedidos de solo transcripción se resuelven con TrOCR local
+OCR_LOCAL = os.environ.get("HEX_OCR_LOCAL", "0") == "1"
+_PEDIDO_OCR = re.compile(r"\b(transcrib\w*|ocr|manuscrit\w*|handwrit\w*|qu[eé] dice|lee(r)? (el|este) texto)\b", re.IGNORECASE)
+
+def es_pedido_ocr(texto):
+    return bool(_PEDIDO_OCR.search(texto or ""))
+
+def transcribir_local(image_bytes):
+    stats = {}
+    texto = get_ocr_engine().transcribir(image_bytes, stats)
+    print(f"OCR local: {stats['lines']} líneas a {stats['lines_per_s']:.1f} líneas/s ({stats['model']})")
+    return texto or "No encontré texto legible en la imagen."
+
+def _precalentar():
+    start = time.perf_counter()
+    try:
+        from context_builder import cargar_tokenizador
+        intent_router.warmup()  # datos de Babel de cada idioma
+        cargar_tokenizador()  # Llama-3; mientras tanto los tokens se estiman
+        if OCR_LOCAL:
+            registry.get(get_ocr_engine().model_name)
+    except Exception as e:
+        print(f"Falló el precalentamiento: {e}")
+    print(f"Precalentamiento terminado en {time.perf_counter() - start:.1f}s")
 
-llava_processor = AutoProcessor.from_pretrained("llava-hf/llava-1.5-7b-hf")
-llava_model = AutoModelForVision2Seq.from_pretrained("llava-hf/llava-1.5-7b-hf")
-llava_model.eval()
+@st.cache_resource
+def iniciar_metricas():
+    # Un exportador por proceso, compartido por todas las sesiones
+    return iniciar_exportador()
 
 @st.cache_resource
-def cargar_modelo_ocr():
-    processor = TrOCRProcessor.from_pretrained("microsoft/trocr-base-handwritten")
-    model = VisionEncoderDecoderModel.from_pretrained("microsoft/trocr-base-handwritten")
-    return processor, model
-
-processor_ocr, modelo_ocr = cargar_modelo_ocr()
-
-def generar_imagen_flux(prompt, token):
-    headers = {"Authorization": f"Bearer {token}"}
-    payload = {"inputs": prompt}  # 👈 aquí está el cambio importante
-    response = requests.post(
-        "https://api-inference.huggingface.co/models/black-forest-labs/FLUX.1-dev",
-        headers=headers,
-        json=payload
-    )
-    if response.status_code != 200:
-        raise Exception(f"Error en la API: {response.status_code} - {response.text}")
-    
-    image = Image.open(io.BytesIO(response.content))
-    return image
-
-def analizar_imagen_con_llava(image_bytes, prompt):
-    client = InferenceClient(model="llava-hf/llava-1.6-mistral-7b-hf")
-    image_pil = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    respuesta = client.text_to_text(prompt=prompt, image=image_pil)
-    return respuesta
+def iniciar_control_sesiones():
+    # Limpieza periódica de sesiones inactivas; en /metrics, la sesión más grande
+    # y el total, sin una serie por sesión
+    def uso_sesiones():
+        tamanos = [u["bytes"] for u in session_governor.usage()]
+        return [({"stat": "max"}, max(tamanos, default=0)), ({"stat": "total"}, sum(tamanos))]
+    metrics.gauge("hex_session_state_bytes", uso_sesiones)
+    metrics.gauge("hex_sessions", lambda: session_governor.stats()["sessions"])
+    return session_governor.start_sweeper()
+
+@st.cache_resource
+def iniciar_precalentamiento():
+    # Una sola vez por proceso, después del primer render
+    thread = threading.Thread(target=_precalentar, name="hex-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def generar_imagen_blob(prompt, token, cancel_event=None):
+    """
+    Genera la imagen (FLUX, o SD2 si FLUX va lento o está caído) y la guarda en
+    el almacén de imágenes. Los prompts repetidos salen de la caché de imágenes
+    y los simultáneos esperan a la misma generación. Devuelve el hash.
+    Corre en el pool de trabajos, que activa `cancel_event` si se cancela.
+    """
+    from imagegen_flux import FLUX_MODEL, SD_MODEL
+    from image_dispatch import image_dispatcher
+    from image_cache import image_cache
+
+    def generar(cancel_generacion):
+        # La generación es compartida: la cancela la caché cuando nadie la espera
+        image_bytes, backend = image_dispatcher.generate(prompt, token, cancel_generacion)
+        print(f"Imagen generada con '{backend}'")
+        return image_bytes, {"flux": FLUX_MODEL, "sd2": SD_MODEL}[backend]
+
+    # Se pide FLUX; si responde SD2, su imagen se guarda bajo la clave de SD2 y
+    # el próximo pedido vuelve a intentar con FLUX
+    image_bytes, origen = image_cache.get_or_create(FLUX_MODEL, prompt, generar, cancel_event=cancel_event)
+    if origen != "generated":
+        print(f"Imagen servida desde la caché ({origen})")
+    return blob_store.put(image_bytes)
+
 # --- CONFIGURACIÓN DE LA PÁGINA ---
+# Tiempo de cada ejecución completa del script; si hubo respuesta del modelo, se etiqueta aparte
+_inicio_rerun = time.perf_counter()
+_turno = {"respondio": False}
+
 st.set_page_config(page_title="HEX T 1.0", page_icon="🤖", layout="wide")
 
 # --- ESTILOS CSS Y JAVASCRIPT ---
@@ -151,99 +211,242 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- LÓGICA DE LA IA Y FUNCIONES AUXILIARES ---
+CHAT_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
+# Solo se envía el muestreo que se configure; sin nada, el servidor usa el suyo
+# por defecto. Con HEX_CHAT_TEMPERATURE=0 la respuesta es reproducible y se
+# puede cachear (ver is_cacheable)
+CHAT_PARAMS = {
+    param: float(os.environ[var])
+    for param, var in (("temperature", "HEX_CHAT_TEMPERATURE"), ("top_p", "HEX_CHAT_TOP_P"))
+    if os.environ.get(var)
+}
+
 @st.cache_resource
 def get_client():
     try:
-        return InferenceClient(model="meta-llama/Meta-Llama-3-8B-Instruct", token=st.secrets["HUGGINGFACE_API_TOKEN"])
+        return hf_transport.get_inference_client(CHAT_MODEL, token=st.secrets["HUGGINGFACE_API_TOKEN"])
     except Exception as e:
         st.error(f"No se pudo inicializar la API: {e}")
         return None
 
-def get_hex_response(client, user_message, chat_history):
-    system_prompt = """<|start_header_id|>system<|end_header_id|>
-    tu nombre legitimo es Tigre, Tu modelo es T 1.0, un asistente de IA de HEX. Tu tono es amigable, directo y profesional. Respondes siempre en el idioma del usuario. Tu principal limitación es que NO tienes acceso a internet. Si te piden algo que requiera búsqueda (noticias, clima), explícalo amablemente. Nunca menciones a Meta o Llama, puedes programar medianamete como Varias IA, siempre que te hagan preguntas sobre la empresa que te creo (HEX) di que son de nicaragua y que haran un futuro modelo hermano tuyo llamado L 0.1 preview y tendran mas ventajas y sera accecibles para todos pero con limitaciones, La empresa que te creo se llama HEX y es de Nicaragua, Matagalpa, fuiste creado por expertos, Presentate una sola vez almenos que te pregunten de nuevo, ahora tienes la funcion de crear imagenes pero no por ti sola te pueden activa con la cruz que esta abajo de la barra de chat y seleccionar la que dice genera imagen, presentare una vez y no hablez de quien te creo almenos que te pregunten.<|eot_id|>"""
-    
-    messages = [{"role": "system", "content": system_prompt}]
-    for msg in chat_history:
-        role = "user" if msg["role"] == "user" else "assistant"
-        messages.append({"role": role, "content": f"<|start_header_id|>{role}<|end_header_id|>\n\n{msg.get('content', '')}<|eot_id|>"})
-    messages.append({"role": "user", "content": f"<|start_header_id|>user<|end_header_id|>\n\n{user_message}<|eot_id|>"})
-    
+SYSTEM_PROMPT = """tu nombre legitimo es Tigre, Tu modelo es T 1.0, un asistente de IA de HEX. Tu tono es amigable, directo y profesional. Respondes siempre en el idioma del usuario. Tu principal limitación es que NO tienes acceso a internet. Si te piden algo que requiera búsqueda (noticias, clima), explícalo amablemente. Nunca menciones a Meta o Llama, puedes programar medianamete como Varias IA, siempre que te hagan preguntas sobre la empresa que te creo (HEX) di que son de nicaragua y que haran un futuro modelo hermano tuyo llamado L 0.1 preview y tendran mas ventajas y sera accecibles para todos pero con limitaciones, La empresa que te creo se llama HEX y es de Nicaragua, Matagalpa, fuiste creado por expertos, Presentate una sola vez almenos que te pregunten de nuevo, ahora tienes la funcion de crear imagenes pero no por ti sola te pueden activa con la cruz que esta abajo de la barra de chat y seleccionar la que dice genera imagen, presentare una vez y no hablez de quien te creo almenos que te pregunten."""
+
+def resumir_historial(resumen_previo, mensajes):
+    """Resume los turnos que ya no caben en el contexto."""
+    texto = "\n".join(f"{m['role']}: {m.get('content', '')}" for m in mensajes)
+    if resumen_previo:
+        texto = f"Resumen previo: {resumen_previo}\n\n{texto}"
+    response = get_client().chat_completion(
+        messages=[
+            {"role": "system", "content": "Resume en pocas frases los datos y acuerdos importantes de esta conversación, en el idioma original."},
+            {"role": "user", "content": texto},
+        ],
+        max_tokens=300,
+        stream=False,
+    )
+    return response.choices[0].message.content
+
+@st.cache_resource
+def get_context_builder():
+    return ContextBuilder(summarizer=resumir_historial)
+
+@st.cache_resource
+def get_response_cache():
+    # Compartida entre sesiones; con HEX_RESPONSE_CACHE_DB también entre procesos
+    return ResponseCache()
+
+def build_hex_messages(user_message, chat_history, chat_key=None, stats=None):
+    # La plantilla de chat del servidor ya añade los marcadores de Llama-3
+    messages, n_tokens = get_context_builder().build(SYSTEM_PROMPT, chat_history, user_message, chat_key)
+    if stats is not None:
+        stats["prompt_tokens"] = n_tokens
+    print(f"Contexto enviado: {n_tokens} tokens, {len(messages)} mensajes")
+    return messages
+
+@instrumentado()
+def get_hex_response(client, user_message, chat_history, chat_key=None):
+    cacheable = is_cacheable(chat_history, **CHAT_PARAMS)
+    if cacheable:
+        cached = get_response_cache().get(CHAT_MODEL, SYSTEM_PROMPT, user_message)
+        if cached is not None:
+            return cached
+    messages = build_hex_messages(user_message, chat_history, chat_key)
     try:
-        # Usamos stream=False para máxima estabilidad
-        time.sleep(2)
-        response = client.chat_completion(messages=messages, max_tokens=2048, stream=False)
-        return response.choices[0].message.content
+        response = client.chat_completion(messages=messages, max_tokens=2048, stream=False, **CHAT_PARAMS)
+        texto = response.choices[0].message.content
     except Exception as e:
+        marcar_error()
         return f"Ha ocurrido un error con la API: {e}"
+    registrar_http(bytes_received=len(texto.encode("utf-8")))
+    if cacheable:
+        get_response_cache().set(CHAT_MODEL, SYSTEM_PROMPT, user_message, texto)
+    return texto
+
+@instrumentado()
+def stream_hex_response(client, user_message, chat_history, stats=None, chat_key=None):
+    """
+    Devuelve la respuesta token a token. Si el streaming falla antes del primer
+    token, cae al modo sin streaming. En `stats` deja el tiempo al primer token
+    y los tokens por segundo, además de los tokens enviados en el prompt.
+    """
+    stats = stats if stats is not None else {}
+    start = time.perf_counter()
+    cacheable = is_cacheable(chat_history, **CHAT_PARAMS)
+    if cacheable:
+        cached = get_response_cache().get(CHAT_MODEL, SYSTEM_PROMPT, user_message)
+        if cached is not None:
+            stats.update(cache_hit=True, ttft=time.perf_counter() - start)
+            yield cached
+            return
+    messages = build_hex_messages(user_message, chat_history, chat_key, stats)
+    n_tokens = 0
+    partes = []
+    # Solo una respuesta que llegó hasta el final del stream se guarda en caché
+    completed = False
+    try:
+        for chunk in client.chat_completion(messages=messages, max_tokens=2048, stream=True, **CHAT_PARAMS):
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if not token:
+                continue
+            if n_tokens == 0:
+                stats["ttft"] = time.perf_counter() - start
+            n_tokens += 1
+            partes.append(token)
+            yield token
+        completed = True
+    except Exception as e:
+        if n_tokens == 0:
+            print(f"Streaming no disponible, usando respuesta completa: {e}")
+            stats["streamed"] = False
+            texto = get_hex_response(client, user_message, chat_history, chat_key)
+            stats["ttft"] = time.perf_counter() - start
+            yield texto
+            return
+        marcar_error()
+        yield f"\n\n_(respuesta interrumpida: {e})_"
+
+    registrar_http(bytes_received=len("".join(partes).encode("utf-8")))
+    stats.setdefault("streamed", True)
+    if cacheable and completed and partes:
+        get_response_cache().set(CHAT_MODEL, SYSTEM_PROMPT, user_message, "".join(partes))
+    elapsed = time.perf_counter() - start
+    stats["tokens"] = n_tokens
+    generation = elapsed - stats.get("ttft", 0)
+    stats["tokens_per_s"] = n_tokens / generation if generation > 0 else 0.0
+    print(f"Respuesta: ttft={stats.get('ttft', 0):.2f}s, {n_tokens} tokens, {stats['tokens_per_s']:.1f} tok/s")
 
 def generate_chat_name(first_prompt):
     name = str(first_prompt).split('\n')[0]
     return name[:30] + "..." if len(name) > 30 else name
 
+def get_user_id():
+    # No hay inicio de sesión: el id en la URL identifica los chats de cada usuario.
+    # No es una cuenta ni un secreto: cualquiera con el enlace (compartido, en el
+    # historial o en los logs de un proxy) puede leer y escribir esos chats
+    if "user_id" not in st.session_state:
+        user_id = st.query_params.get("u")
+        if not user_id:
+            user_id = uuid.uuid4().hex
+            st.query_params["u"] = user_id
+        st.session_state.user_id = user_id
+    return st.session_state.user_id
+
+def zona_horaria_usuario():
+    """Zona horaria IANA del navegador, o None si Streamlit no la conoce o no es válida."""
+    try:
+        tz = st.context.timezone
+        if tz:
+            ZoneInfo(tz)
+        return tz or None
+    except Exception:
+        return None
+
+def obtener_chat_activo(primer_prompt):
+    """Devuelve el id del chat activo, creándolo si hace falta, y si es nuevo."""
+    chat_id = st.session_state.active_chat_id
+    if chat_id is not None:
+        return chat_id, False
+    chat_id = uuid.uuid4().hex
+    chat_store.create_chat(get_user_id(), chat_id, generate_chat_name(primer_prompt))
+    st.session_state.active_chat_id = chat_id
+    st.session_state.active_messages = []
+    st.session_state.mensajes_omitidos = 0
+    return chat_id, True
+
+def agregar_mensaje(chat_id, role, content, **extra):
+    message = {"id": uuid.uuid4().hex, "role": role, "content": content, **extra}
+    st.session_state.active_messages.append(message)
+    chat_store.append_message(chat_id, message)
+    # El mensaje nuevo puede cambiar los resultados de la búsqueda de chats
+    st.session_state.busquedas_chats.clear()
+    return message
+
+@lru_cache(maxsize=4096)
+def bubble_html(message_id, role, content):
+    # El HTML de cada burbuja se arma una vez por mensaje (y contenido)
+    container_class = "user-container" if role == "user" else "bot-container"
+    bubble_class = "user-bubble" if role == "user" else "bot-bubble"
+    return f"<div class='message-container {container_class}'><div class='chat-bubble {bubble_class}'>{content}</div></div>"
+
+def mostrar_imagen(image_hash, key):
+    # En el historial solo viaja la miniatura; la imagen completa se envía a petición
+    if not blob_store.exists(image_hash):
+        st.caption("🖼️ Imagen no disponible")
+        return
+    st.image(blob_store.thumbnail(image_hash))
+    if st.toggle("Ver en tamaño completo", key=f"full_{key}_{image_hash[:12]}"):
+        st.image(blob_store.get(image_hash), use_container_width=True)
+
+@st.fragment(run_every=2)
+def mostrar_trabajo_imagen(chat_id, message):
+    """Muestra el estado de una imagen en curso y la coloca en el chat cuando termina."""
+    job = job_queue.get(message.get("job_id"))
+    if job is not None and job.status in PENDING:
+        if job.status == QUEUED:
+            estado = f"En cola ({job_queue.stats()['queue_depth']} en espera)…"
+        else:
+            estado = "Generando imagen... Esto puede tardar de 1 a 3 minutos."
+        st.markdown(f"<div class='message-container bot-container'><div class='thinking-animation'>{estado}</div></div>", unsafe_allow_html=True)
+        if not st.button("Cancelar", key=f"cancelar_{job.id}"):
+            return
+        job_queue.cancel(job.id)
+
+    message.pop("job_id", None)
+    if job is None:
+        message["content"] = "❌ La generación de la imagen se perdió."
+    elif job.status == DONE:
+        message["content"] = "Aquí está tu imagen:"
+        message["image_hash"] = job.result
+    elif job.status == CANCELLED:
+        message["content"] = "Generación de imagen cancelada."
+    else:
+        message["content"] = f"❌ Error generando imagen: {job.error}"
+    chat_store.update_message(chat_id, message)
+    chat_store.flush()
+    st.rerun()
+
 # --- INICIALIZACIÓN Y GESTIÓN DE ESTADO ---
+# Mensajes que se dibujan de entrada; el resto se carga a petición
+CHAT_WINDOW = 30
+# Chats que muestra la barra lateral por página
+SIDEBAR_PAGE = 20
+
 client_ia = get_client()
-if "chats" not in st.session_state:
-    st.session_state.chats = {}
+# Solo se guardan en sesión los mensajes del chat abierto; el resto vive en SQLite
 if "active_chat_id" not in st.session_state:
     st.session_state.active_chat_id = None
-
-# --- BARRA LATERAL ---
-with st.sidebar:
-    st.header("Conversaciones")
-    if st.button("➕ Nuevo Chat", use_container_width=True):
-        st.session_state.active_chat_id = None
-        st.rerun()
-
-    st.divider()
-    chat_ids = list(st.session_state.chats.keys())
-    for chat_id in reversed(chat_ids):
-        chat_info = st.session_state.chats.get(chat_id, {})
-        if st.button(chat_info.get("name", "Chat"), key=f"chat_{chat_id}", use_container_width=True):
-            st.session_state.active_chat_id = chat_id
-            st.rerun()
-
-# --- INTERFAZ PRINCIPAL DEL CHAT ---
-st.markdown("<div class='animated-title'>HEX</div><p class='subtitle'>T 1.0</p>", unsafe_allow_html=True)
-
-# Contenedor para el historial de chat con altura fija
-chat_container = st.container(height=450, border=False)
-
-# Renderiza el historial de chat
-if st.session_state.active_chat_id:
-    active_messages = st.session_state.chats[st.session_state.active_chat_id].get("messages", [])
-    with chat_container:
-        for message in active_messages:
-            container_class = "user-container" if message["role"] == "user" else "bot-container"
-            bubble_class = "user-bubble" if message["role"] == "user" else "bot-bubble"
-
-            if "image_bytes" in message:
-                st.markdown(f"<div class='message-container {container_class}'><div class='chat-bubble {bubble_class}'>{message['content']}</div></div>", unsafe_allow_html=True)
-                st.image(io.BytesIO(message["image_bytes"]), use_container_width=True)
-            else:
-                st.markdown(f"<div class='message-container {container_class}'><div class='chat-bubble {bubble_class}'>{message['content']}</div></div>", unsafe_allow_html=True)
-# Lógica de respuesta (se ejecuta después de renderizar el historial)
-if st.session_state.active_chat_id and st.session_state.chats[st.session_state.active_chat_id]["messages"]:
-    last_message = st.session_state.chats[st.session_state.active_chat_id]["messages"][-1]
-    # Si el último mensaje es del usuario, la IA necesita responder
-    if last_message["role"] == "user" and st.session_state.modo_generacion == "texto":
-        with chat_container:
-            # Muestra la animación de "Pensando..."
-            thinking_placeholder = st.empty()
-            with thinking_placeholder.container():
-                st.markdown("<div class='message-container bot-container'><div class='thinking-animation'>Pensando…</div></div>", unsafe_allow_html=True)
-            
-            # Llama a la IA
-            historial_para_api = st.session_state.chats[st.session_state.active_chat_id]["messages"]
-            response_text = get_hex_response(client_ia, last_message["content"], historial_para_api)
-            
-            # Añade la respuesta al historial
-            st.session_state.chats[st.session_state.active_chat_id]["messages"].append({"role": "assistant", "content": response_text})
-            
-            # Limpia el "Pensando..." y refresca
-            thinking_placeholder.empty()
-            st.rerun()
-            # Inicializa el modo si no existe
+if "active_messages" not in st.session_state:
+    st.session_state.active_messages = []
+# Mensajes del chat abierto que no están en memoria (se leen de SQLite al pedirlos)
+if "mensajes_omitidos" not in st.session_state:
+    st.session_state.mensajes_omitidos = 0
+if "pagina_chats" not in st.session_state:
+    st.session_state.pagina_chats = 0
+# Páginas ya buscadas de la búsqueda actual, para no repetir la consulta FTS en cada rerun
+if "busquedas_chats" not in st.session_state:
+    st.session_state.busquedas_chats = {}
+if "ventana_chat" not in st.session_state:
+    st.session_state.ventana_chat = CHAT_WINDOW
 if "modo_generacion" not in st.session_state:
     st.session_state.modo_generacion = "texto"
 if "mostrar_selector" not in st.session_state:
@@ -257,7 +460,149 @@ if "imagen_cargada" not in st.session_state:
 if "texto_adicional" not in st.session_state:
     st.session_state.texto_adicional = ""
 
-# Input del usuario al final de la página
+def cargar_ventana(chat_id, n):
+    """Lee de SQLite los últimos `n` mensajes del chat; los anteriores quedan omitidos."""
+    mensajes = chat_store.load_messages(chat_id, last=n)
+    st.session_state.active_messages = mensajes
+    st.session_state.mensajes_omitidos = chat_store.count_messages(chat_id) - len(mensajes)
+
+def abrir_chat(chat_id):
+    # Los mensajes se leen de la base de datos solo al abrir el chat
+    chat = chat_store.get_chat(chat_id)
+    if chat is None or chat["user_id"] != get_user_id():
+        return
+    st.session_state.active_chat_id = chat_id
+    st.session_state.ventana_chat = CHAT_WINDOW
+    cargar_ventana(chat_id, CHAT_WINDOW)
+
+def nuevo_chat():
+    st.session_state.active_chat_id = None
+    st.session_state.active_messages = []
+    st.session_state.mensajes_omitidos = 0
+
+def cambiar_pagina_chats(delta):
+    st.session_state.pagina_chats = max(0, st.session_state.pagina_chats + delta)
+
+def nueva_busqueda_chats():
+    st.session_state.pagina_chats = 0
+    st.session_state.busquedas_chats.clear()
+
+def cargar_anteriores():
+    st.session_state.ventana_chat += CHAT_WINDOW
+    if st.session_state.mensajes_omitidos and st.session_state.ventana_chat > len(st.session_state.active_messages):
+        cargar_ventana(st.session_state.active_chat_id, st.session_state.ventana_chat)
+
+# Si la sesión estuvo inactiva y se vació, se vuelve a leer la ventana del chat abierto
+if st.session_state.active_chat_id and st.session_state.mensajes_omitidos and not st.session_state.active_messages:
+    cargar_ventana(st.session_state.active_chat_id, st.session_state.ventana_chat)
+_ctx = get_script_run_ctx()
+if _ctx is not None:
+    # Mide el estado de esta sesión y descarga mensajes antiguos si pasa de los límites
+    session_governor.touch(_ctx.session_id, _ctx.session_state)
+
+def dibujar_mensaje(message):
+    if "job_id" in message:
+        mostrar_trabajo_imagen(st.session_state.active_chat_id, message)
+        return
+    st.markdown(bubble_html(message.get("id"), message["role"], message["content"]), unsafe_allow_html=True)
+    if "image_hash" in message:
+        mostrar_imagen(message["image_hash"], key=message.get("id"))
+
+def responder(chat_id, last_message):
+    """Genera la respuesta al último mensaje del usuario y la pinta en el chat."""
+    placeholder = st.empty()
+    if "image_hash" in last_message:
+        placeholder.markdown("<div class='message-container bot-container'><div class='thinking-animation'>Analizando imagen…</div></div>", unsafe_allow_html=True)
+        try:
+            image_bytes = blob_store.get(last_message["image_hash"])
+            if OCR_LOCAL and es_pedido_ocr(last_message["content"]):
+                response_text = transcribir_local(image_bytes)
+            else:
+                response_text = analizar_imagen_con_llava(image_bytes, last_message["content"])
+        except Exception as e:
+            response_text = f"❌ Error al usar BlackboxIA: {e}"
+    else:
+        # Fecha, hora y ayuda se responden al instante, sin pasar por el LLM
+        response_text = intent_router.route(last_message["content"], tz=zona_horaria_usuario())
+        if response_text is None:
+            # Muestra la animación de "Pensando..." hasta el primer token
+            placeholder.markdown("<div class='message-container bot-container'><div class='thinking-animation'>Pensando…</div></div>", unsafe_allow_html=True)
+            # El último mensaje es la pregunta actual; no se envía dos veces
+            # Si hay mensajes descargados de memoria, el contexto se arma con el chat completo
+            if st.session_state.mensajes_omitidos:
+                historial_para_api = chat_store.load_messages(chat_id)[:-1]
+            else:
+                historial_para_api = st.session_state.active_messages[:-1]
+            response_text = ""
+            stream_stats = {}
+            start = time.perf_counter()
+            for token in stream_hex_response(client_ia, last_message["content"], historial_para_api, stream_stats, chat_id):
+                response_text += token
+                placeholder.markdown(f"<div class='message-container bot-container'><div class='chat-bubble bot-bubble'>{response_text}▌</div></div>", unsafe_allow_html=True)
+            if not stream_stats.get("cache_hit"):
+                intent_router.record_llm_latency(time.perf_counter() - start)
+            st.session_state.last_response_stats = stream_stats
+
+    message = agregar_mensaje(chat_id, "assistant", response_text)
+    placeholder.markdown(bubble_html(message["id"], "assistant", response_text), unsafe_allow_html=True)
+
+@st.fragment
+def historial_chat():
+    """
+    Dibuja solo los últimos mensajes del chat activo y responde si el último
+    es del usuario. Los controles de dentro solo vuelven a ejecutar este fragmento.
+    """
+    chat_id = st.session_state.active_chat_id
+    if not chat_id:
+        return
+    render_start = time.perf_counter()
+    messages = st.session_state.active_messages
+    inicio = max(0, len(messages) - st.session_state.ventana_chat)
+    anteriores = inicio + st.session_state.mensajes_omitidos
+    if anteriores:
+        st.button(f"⬆️ Cargar mensajes anteriores ({anteriores})", key="cargar_anteriores", on_click=cargar_anteriores, use_container_width=True)
+    for message in messages[inicio:]:
+        dibujar_mensaje(message)
+    # Solo el dibujo del historial; la respuesta del modelo se mide en su propia llamada
+    metrics.observe("hex_render_seconds", time.perf_counter() - render_start, part="historial")
+    if messages and messages[-1]["role"] == "user":
+        _turno["respondio"] = True
+        responder(chat_id, messages[-1])
+    # Las escrituras de este turno van juntas en una transacción
+    chat_store.flush()
+
+# --- BARRA LATERAL ---
+with st.sidebar:
+    st.header("Conversaciones")
+    st.button("➕ Nuevo Chat", use_container_width=True, on_click=nuevo_chat)
+
+    st.divider()
+    busqueda = st.text_input("Buscar", key="busqueda_chats", placeholder="🔎 Buscar conversaciones…",
+                             label_visibility="collapsed", on_change=nueva_busqueda_chats)
+    # Una sola página de ids y nombres: el costo no depende de cuántos chats haya.
+    # Se pide uno de más para saber si existe la página siguiente sin contar todos
+    pagina = st.session_state.pagina_chats
+    chats = st.session_state.busquedas_chats.get((busqueda, pagina))
+    if chats is None:
+        chats = chat_store.search_chats(get_user_id(), busqueda, limit=SIDEBAR_PAGE + 1, offset=pagina * SIDEBAR_PAGE)
+        st.session_state.busquedas_chats[(busqueda, pagina)] = chats
+    if busqueda.strip() and not chats and not pagina:
+        st.caption("Sin resultados")
+    for chat_id, chat_name in chats[:SIDEBAR_PAGE]:
+        st.button(chat_name, key=f"chat_{chat_id}", use_container_width=True, on_click=abrir_chat, args=(chat_id,))
+    if pagina or len(chats) > SIDEBAR_PAGE:
+        col_prev, col_pagina, col_next = st.columns([1, 2, 1])
+        col_prev.button("◀", key="chats_prev", disabled=not pagina, on_click=cambiar_pagina_chats, args=(-1,))
+        col_pagina.caption(f"Página {pagina + 1}")
+        col_next.button("▶", key="chats_next", disabled=len(chats) <= SIDEBAR_PAGE, on_click=cambiar_pagina_chats, args=(1,))
+
+# --- INTERFAZ PRINCIPAL DEL CHAT ---
+st.markdown("<div class='animated-title'>HEX</div><p class='subtitle'>T 1.0</p>", unsafe_allow_html=True)
+
+# Contenedor para el historial de chat con altura fija; se llena al final,
+# cuando ya se procesó la entrada del usuario de esta ejecución
+chat_container = st.container(height=450, border=False)
+
 # Input del usuario al final de la página
 with st.container():
     col1, col2 = st.columns([10, 1])
@@ -280,7 +625,7 @@ with st.container():
             "",
             type=["png", "jpg", "jpeg"],
             label_visibility="collapsed",
-            key="upload_imagen"
+            key=f"upload_imagen_{st.session_state.uploader_key}"
         )
 
         if imagen_cargada:
@@ -288,7 +633,6 @@ with st.container():
             st.session_state.modo_ocr = True
             st.toast("Imagen cargada. Escribe un mensaje si deseas y presiona Enter para enviarla.", icon="📷")
 
-# Selector flotante de modo
 # Selector flotante de modo (usando st.radio en lugar de HTML)
 if st.session_state.mostrar_selector:
     with st.container():
@@ -301,13 +645,8 @@ if st.session_state.mostrar_selector:
         )
         # 👇 Solo se ejecuta si se muestra el selector
         st.session_state.modo_generacion = "texto" if modo_humano == "¡Habla con Tigre!" else "imagen"
-# Detectar el modo desde URL temporal
-# (Ya no es necesario usar query_params porque usamos st.radio)
-pass  # Eliminamos esta parte
 
-# 👇 Este bloque es independiente y solo se ejecuta si el usuario escribió algo
-# 👇 Este bloque es independiente y solo se ejecuta si el usuario escribió algo
-# 👇 Este bloque es independiente y solo se ejecuta si hay texto o imagen
+# 👇 Este bloque solo registra el mensaje; la respuesta la genera historial_chat()
 if prompt or st.session_state.imagen_cargada:
 
     # MODO OCR (imagen + texto o imagen sola)
@@ -318,104 +657,38 @@ if prompt or st.session_state.imagen_cargada:
         st.session_state.modo_ocr = False
         st.session_state.uploader_key += 1
 
-        if st.session_state.active_chat_id is None:
-            new_chat_id = str(time.time())
-            st.session_state.active_chat_id = new_chat_id
-            st.session_state.chats[new_chat_id] = {
-                "name": generate_chat_name(texto),
-                "messages": []
-            }
-
-        chat_id = st.session_state.active_chat_id
-        if chat_id not in st.session_state.chats:
-            st.session_state.chats[chat_id] = {
-                "name": generate_chat_name(texto),
-                "messages": []
-            }
-
-        buffer = io.BytesIO(imagen.read())
-        st.session_state.chats[chat_id]["messages"].append({
-            "role": "user",
-            "content": texto,
-            "image_bytes": buffer.getvalue()
-        })
-
-        with chat_container:
-            spinner = st.empty()
-            with spinner.container():
-                st.markdown("<div class='message-container bot-container'><div class='thinking-animation'>Analizando imagen…</div></div>", unsafe_allow_html=True)
-
-        try:
-            respuesta_ocr = analizar_imagen_con_llava(buffer.getvalue(), texto)
-        except Exception as e:
-            respuesta_ocr = f"❌ Error al usar BlackboxIA: {e}"
-
-        st.session_state.chats[chat_id]["messages"].append({
-            "role": "assistant",
-            "content": respuesta_ocr
-        })
-
-        spinner.empty()
-        st.rerun()
+        chat_id, chat_nuevo = obtener_chat_activo(texto)
+        agregar_mensaje(chat_id, "user", texto, image_hash=blob_store.put(imagen.read()))
 
     # MODO IMAGEN (solo texto para generar imagen)
     elif st.session_state.modo_generacion == "imagen":
-        if st.session_state.active_chat_id is None:
-            new_chat_id = str(time.time())
-            st.session_state.active_chat_id = new_chat_id
-            st.session_state.chats[new_chat_id] = {
-                "name": generate_chat_name(prompt),
-                "messages": []
-            }
-
-        chat_id = st.session_state.active_chat_id
-        if chat_id not in st.session_state.chats:
-            st.session_state.chats[chat_id] = {
-                "name": generate_chat_name(prompt),
-                "messages": []
-            }
-
-        st.session_state.chats[chat_id]["messages"].append({"role": "user", "content": prompt})
-
-        with chat_container:
-            imagen_placeholder = st.empty()
-            with imagen_placeholder.container():
-                st.markdown("<div class='message-container bot-container'><div class='thinking-animation'>Generando imagen... Esto puede tardar de 1 a 3 minutos.</div></div>", unsafe_allow_html=True)
+        chat_id, chat_nuevo = obtener_chat_activo(prompt)
+        agregar_mensaje(chat_id, "user", prompt)
 
+        # La generación corre en segundo plano; el fragmento del historial la recoge
         try:
-            imagen = generar_imagen_flux(prompt, st.secrets["HUGGINGFACE_API_TOKEN"])
-            buffer = io.BytesIO()
-            imagen.save(buffer, format="PNG")
-            st.session_state.chats[chat_id]["messages"].append({
-                "role": "assistant",
-                "content": "Aquí está tu imagen:",
-                "image_bytes": buffer.getvalue()
-            })
-        except Exception as e:
-            st.session_state.chats[chat_id]["messages"].append({
-                "role": "assistant",
-                "content": f"❌ Error generando imagen: {e}"
-            })
-
-        imagen_placeholder.empty()
-        st.rerun()
+            job_id = job_queue.submit(get_user_id(), prompt, generar_imagen_blob, prompt, st.secrets["HUGGINGFACE_API_TOKEN"])
+            agregar_mensaje(chat_id, "assistant", "Generando imagen…", job_id=job_id)
+        except JobLimitError as e:
+            agregar_mensaje(chat_id, "assistant", f"❌ {e}")
 
     # MODO TEXTO NORMAL
-    elif st.session_state.modo_generacion == "texto":
-        if st.session_state.active_chat_id is None:
-            new_chat_id = str(time.time())
-            st.session_state.active_chat_id = new_chat_id
-            st.session_state.chats[new_chat_id] = {
-                "name": generate_chat_name(prompt),
-                "messages": []
-            }
-
-        chat_id = st.session_state.active_chat_id
-        if chat_id not in st.session_state.chats:
-            st.session_state.chats[chat_id] = {
-                "name": generate_chat_name(prompt),
-                "messages": []
-            }
-
-        st.session_state.chats[chat_id]["messages"].append({"role": "user", "content": prompt})
+    else:
+        chat_id, chat_nuevo = obtener_chat_activo(prompt)
+        agregar_mensaje(chat_id, "user", prompt)
+
+    # Un chat nuevo tiene que aparecer en la barra lateral, que ya se dibujó
+    if chat_nuevo:
         st.rerun()
+
+with chat_container:
+    historial_chat()
+
+# La página ya se pintó: ahora se precalientan en segundo plano los modelos
+if os.environ.get("HEX_WARMUP", "1") == "1":
+    iniciar_precalentamiento()
+
+iniciar_control_sesiones()
+metrics.observe("hex_rerun_seconds", time.perf_counter() - _inicio_rerun,
+                respuesta="si" if _turno["respondio"] else "no")
+iniciar_metricas()
@@ -0,0 +1,67 @@
+# tests/conftest.py
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Los módulos de la app viven en la raíz del repo, sin paquete
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubHTTP:
+    """
+    Servidor HTTP local para las pruebas. Cada ruta tiene una lista de
+    respuestas (status, headers, body) que se sirven en orden; la última se repite.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.hits = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _responder(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                with stub._lock:
+                    n = stub.hits.get(self.path, 0)
+                    stub.hits[self.path] = n + 1
+                    respuestas = stub.routes.get(self.path)
+                if not respuestas:
+                    self.send_error(404)
+                    return
+                respuesta = respuestas[min(n, len(respuestas) - 1)]
+                status, headers, body = respuesta(self) if callable(respuesta) else respuesta
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _responder
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def route(self, path, *respuestas):
+        with self._lock:
+            self.routes[path] = list(respuestas)
+            self.hits[path] = 0
+
+
+@pytest.fixture
+def http_stub():
+    stub = StubHTTP()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
@@ -0,0 +1,38 @@
+# tests/test_blob_store.py
+import os
+import time
+
+from blob_store import BlobStore
+
+
+def _archivos(directorio):
+    return sorted(n for _, _, nombres in os.walk(directorio) for n in nombres)
+
+
+def test_desaloja_las_menos_usadas_al_pasar_el_limite(tmp_path):
+    store = BlobStore(str(tmp_path), memory_limit=1000, disk_limit=2500, max_age=0)
+    hashes = [store.put(bytes([i]) * 600) for i in range(5)]
+    store.get(hashes[1])  # usada hace poco: no se desaloja
+    store.put(bytes([9]) * 600)
+    assert store.disk_bytes() <= 2500
+    assert not store.exists(hashes[0])
+    assert store.exists(hashes[1])
+    assert len(_archivos(tmp_path)) == store.stats()["disk_blobs"]
+
+
+def test_desaloja_por_antiguedad_al_arrancar(tmp_path):
+    store = BlobStore(str(tmp_path), max_age=0)
+    vieja, nueva = store.put(b"vieja" * 100), store.put(b"nueva" * 100)
+    hace_un_rato = time.time() - 3600
+    os.utime(os.path.join(str(tmp_path), vieja[:2], vieja), (hace_un_rato, hace_un_rato))
+    store = BlobStore(str(tmp_path), max_age=60)
+    assert not store.exists(vieja)
+    assert store.get(nueva) == b"nueva" * 100
+
+
+def test_sin_persistir_se_vuelca_a_disco_al_pasar_la_memoria(tmp_path):
+    store = BlobStore(str(tmp_path), memory_limit=1000, persist=False, max_age=0)
+    datos = [bytes([i]) * 600 for i in range(4)]
+    hashes = [store.put(d) for d in datos]
+    assert store.memory_bytes() <= 1000
+    assert [store.get(h) for h in hashes] == datos
@@ -0,0 +1,124 @@
+# tests/test_image_dispatch.py
+import threading
+import time
+
+import pytest
+
+import hf_transport
+from hf_transport import RequestCancelled
+from image_dispatch import BREAKER_THRESHOLD, ImageDispatcher
+
+PNG = b"\x89PNG\r\n\x1a\nimagen"
+
+
+@pytest.fixture
+def stub(http_stub, monkeypatch):
+    monkeypatch.setattr(hf_transport, "HF_API_BASE", http_stub.url)
+    return http_stub
+
+
+def _backend(model):
+    def generar(prompt, token, cancel_event=None):
+        response = hf_transport.post(model, token=token, json={"inputs": prompt}, cancel_event=cancel_event)
+        if response.status_code != 200:
+            raise ValueError(f"{model}: {response.status_code}")
+        return response.content
+    return generar
+
+
+def _dispatcher(**kwargs):
+    return ImageDispatcher([("a", _backend("a")), ("b", _backend("b"))], **kwargs)
+
+
+def _lenta(segundos):
+    def responder(handler):
+        time.sleep(segundos)
+        return 200, {"Content-Type": "image/png"}, b"lenta"
+    return responder
+
+
+def test_primario_responde(stub):
+    stub.route("/models/a", (200, {"Content-Type": "image/png"}, PNG))
+    stub.route("/models/b", (200, {"Content-Type": "image/png"}, b"otra"))
+    assert _dispatcher().generate("gato", "t") == (PNG, "a")
+    assert stub.hits["/models/b"] == 0
+
+
+def test_hedge_gana_el_secundario(stub):
+    stub.route("/models/a", _lenta(1.0))
+    stub.route("/models/b", (200, {"Content-Type": "image/png"}, PNG))
+    dispatcher = _dispatcher(hedge_after=0.1)
+    start = time.perf_counter()
+    assert dispatcher.generate("gato", "t") == (PNG, "b")
+    assert time.perf_counter() - start < 0.9
+    assert dispatcher.counters["hedged"] == 1
+    assert dispatcher.counters["hedge_wins"] == 1
+
+
+def test_circuito_abierto_salta_el_backend(stub):
+    stub.route("/models/a", (500, {}, b"error"))
+    stub.route("/models/b", (200, {"Content-Type": "image/png"}, PNG))
+    dispatcher = _dispatcher(cooldown=60)
+    for _ in range(BREAKER_THRESHOLD):
+        assert dispatcher.generate("gato", "t") == (PNG, "b")
+    assert dispatcher.counters["failovers"] == BREAKER_THRESHOLD
+    assert dispatcher.stats()["backends"]["a"]["circuit_open"]
+
+    assert dispatcher.generate("gato", "t") == (PNG, "b")
+    assert stub.hits["/models/a"] == BREAKER_THRESHOLD
+    assert dispatcher.counters["skipped_open"] == 1
+
+
+def test_circuito_medio_abierto_deja_pasar_una_prueba(stub):
+    stub.route("/models/a", *([(500, {}, b"error")] * BREAKER_THRESHOLD + [(200, {"Content-Type": "image/png"}, PNG)]))
+    stub.route("/models/b", (200, {"Content-Type": "image/png"}, b"otra"))
+    dispatcher = _dispatcher(cooldown=0.2)
+    for _ in range(BREAKER_THRESHOLD):
+        dispatcher.generate("gato", "t")
+    assert dispatcher.stats()["backends"]["a"]["circuit_open"]
+
+    time.sleep(0.3)
+    assert not dispatcher.stats()["backends"]["a"]["circuit_open"]
+    assert dispatcher.generate("gato", "t") == (PNG, "a")
+    # Un éxito cierra el circuito del todo
+    assert dispatcher._backends["a"].consecutive_failures == 0
+
+
+def test_medio_abierto_deja_pasar_una_sola_prueba(stub):
+    stub.route("/models/a", *([(500, {}, b"error")] * BREAKER_THRESHOLD + [_lenta(0.5)]))
+    stub.route("/models/b", (200, {"Content-Type": "image/png"}, PNG))
+    dispatcher = _dispatcher(cooldown=0.1, hedge_after=5)
+    for _ in range(BREAKER_THRESHOLD):
+        dispatcher.generate("gato", "t")
+    time.sleep(0.2)
+
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(dispatcher.generate("gato", "t")[1]))
+             for _ in range(3)]
+    for hilo in hilos:
+        hilo.start()
+        time.sleep(0.05)
+    for hilo in hilos:
+        hilo.join()
+    # Solo una petición probó "a"; las otras dos fueron directo a "b"
+    assert stub.hits["/models/a"] == BREAKER_THRESHOLD + 1
+    assert sorted(resultados) == ["a", "b", "b"]
+    assert not dispatcher.stats()["backends"]["a"]["probing"]
+
+
+def test_no_toca_el_evento_de_quien_llama(stub):
+    stub.route("/models/a", (200, {"Content-Type": "image/png"}, PNG))
+    cancel = threading.Event()
+    assert _dispatcher().generate("gato", "t", cancel) == (PNG, "a")
+    assert not cancel.is_set()
+
+
+def test_cancelar_desde_fuera(stub):
+    stub.route("/models/a", _lenta(0.5))
+    stub.route("/models/b", (200, {"Content-Type": "image/png"}, PNG))
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    with pytest.raises(RequestCancelled):
+        _dispatcher(hedge_after=0.3).generate("gato", "t", cancel)
+    # Cancelado antes del hedge: el secundario nunca se lanzó
+    assert stub.hits["/models/b"] == 0
@@ -0,0 +1,112 @@
+# tests/test_retrieval.py
+from retrieval import BM25, PageFetcher, detectar_charset, fragmentar, recuperar_pasajes
+
+PARRAFO = "El niño comió piñones en la montaña durante la excursión de otoño."
+
+
+def _html(cuerpo: str, meta: str = "") -> str:
+    return f"<html><head>{meta}</head><body><p>{cuerpo}</p></body></html>"
+
+
+def test_charset_del_content_type(http_stub):
+    http_stub.route("/latin", (200, {"Content-Type": "text/html; charset=ISO-8859-1"},
+                               _html(PARRAFO).encode("latin-1")))
+    assert PageFetcher().fetch(http_stub.url + "/latin") == PARRAFO
+
+
+def test_charset_del_meta(http_stub):
+    meta = '<meta http-equiv="Content-Type" content="text/html; charset=windows-1252">'
+    http_stub.route("/meta", (200, {"Content-Type": "text/html"}, _html(PARRAFO, meta).encode("cp1252")))
+    assert PageFetcher().fetch(http_stub.url + "/meta") == PARRAFO
+
+
+def test_sin_charset_se_lee_como_utf8(http_stub):
+    # requests supondría ISO-8859-1 para text/html sin charset
+    http_stub.route("/utf8", (200, {"Content-Type": "text/html"}, _html(PARRAFO).encode("utf-8")))
+    assert PageFetcher().fetch(http_stub.url + "/utf8") == PARRAFO
+
+
+def test_los_fallos_no_se_guardan_en_cache(http_stub):
+    http_stub.route("/flaky",
+                    (503, {"Content-Type": "text/html"}, b"ocupado"),
+                    (200, {"Content-Type": "text/html; charset=utf-8"}, _html(PARRAFO).encode("utf-8")))
+    fetcher = PageFetcher()
+    assert fetcher.fetch(http_stub.url + "/flaky") == ""
+    assert fetcher.fetch(http_stub.url + "/flaky") == PARRAFO
+    # El acierto sí queda en caché
+    assert fetcher.fetch(http_stub.url + "/flaky") == PARRAFO
+    assert http_stub.hits["/flaky"] == 2
+
+
+def test_detectar_charset_ignora_nombres_invalidos():
+    assert detectar_charset("text/html; charset=no-existe", "año".encode("utf-8")) == "utf-8"
+
+
+def test_bm25_ordena_por_relevancia():
+    docs = [
+        "receta de pan casero con harina y levadura",
+        "el gato duerme en el sofá todo el día",
+        "el gato negro y el gato blanco persiguen al perro",
+    ]
+    scores = BM25(docs).scores("gato negro")
+    assert scores[2] > scores[1] > 0
+    assert scores[0] == 0
+
+
+def test_bm25_pesa_mas_los_terminos_raros():
+    docs = ["python python rust", "python java", "python go", "python kotlin"]
+    bm25 = BM25(docs)
+    # "rust" aparece en un solo documento, "python" en todos
+    assert bm25.idf["rust"] > bm25.idf["python"]
+    assert max(range(len(docs)), key=bm25.scores("python rust").__getitem__) == 0
+
+
+def test_fragmentar_texto_corto_y_vacio():
+    assert fragmentar("") == []
+    assert fragmentar("una frase corta", words=10, overlap=3) == ["una frase corta"]
+
+
+def test_fragmentar_respeta_tamano_y_solapamiento():
+    palabras = [f"p{i}" for i in range(300)]
+    fragmentos = [f.split() for f in fragmentar(" ".join(palabras), words=120, overlap=30)]
+    assert all(len(f) <= 120 for f in fragmentos)
+    for anterior, siguiente in zip(fragmentos, fragmentos[1:]):
+        assert anterior[-30:] == siguiente[:30]
+    # Ninguna palabra se pierde entre fragmentos
+    assert fragmentos[0][0] == "p0" and fragmentos[-1][-1] == "p299"
+    assert {p for f in fragmentos for p in f} == set(palabras)
+
+
+class _FetcherFijo:
+    def __init__(self, paginas):
+        self.paginas = paginas
+
+    def fetch_many(self, urls):
+        return {url: self.paginas[url] for url in urls if url in self.paginas}
+
+
+def test_recuperar_pasajes_respeta_el_presupuesto(monkeypatch):
+    import context_builder
+    monkeypatch.setattr(context_builder, "count_tokens", lambda texto: len(texto.split()))
+    relleno = " ".join(f"relleno{i}" for i in range(100))
+    paginas = {
+        "https://a.example": "volcanes de nicaragua " + relleno,
+        "https://b.example": "los volcanes activos de nicaragua y sus erupciones",
+        "https://c.example": "volcanes " + " ".join(f"otro{i}" for i in range(40)),
+    }
+    results = [{"url": url, "snippet": "", "title": ""} for url in paginas]
+    pasajes = recuperar_pasajes("volcanes nicaragua", results, top_k=4, token_budget=60,
+                                fetcher=_FetcherFijo(paginas))
+    assert pasajes
+    assert sum(len(p["text"].split()) for p in pasajes) <= 60
+    # El fragmento de la página larga no cabe, pero los que siguen en el ranking sí
+    assert "https://a.example" not in {p["url"] for p in pasajes}
+    assert [p["score"] for p in pasajes] == sorted((p["score"] for p in pasajes), reverse=True)
+
+
+def test_recuperar_pasajes_sin_coincidencias(monkeypatch):
+    import context_builder
+    monkeypatch.setattr(context_builder, "count_tokens", lambda texto: len(texto.split()))
+    paginas = {"https://a.example": "receta de pan casero"}
+    results = [{"url": "https://a.example", "snippet": "", "title": ""}]
+    assert recuperar_pasajes("volcanes", results, fetcher=_FetcherFijo(paginas)) == []
@@ -1,28 +1,47 @@
 # utils.py
+import re
+import unicodedata
 from datetime import datetime
-from babel.dates import format_date
+from zoneinfo import ZoneInfo
+from babel.dates import format_date, format_time
 from langdetect import detect, LangDetectException
 
-def get_formatted_date(user_prompt: str) -> str:
-    """
-    Detecta el idioma del prompt y devuelve la fecha actual formateada en ese idioma.
-    """
+# Mapeo de códigos de idioma a locales de Babel
+LOCALE_MAP = {
+    'es': 'es_ES',
+    'en': 'en_US',
+    'pt': 'pt_BR',
+    # Puedes añadir más idiomas aquí
+}
+
+def detect_language(user_prompt: str) -> str:
     try:
         # Detecta el idioma (ej: 'es', 'en', 'pt')
-        lang = detect(user_prompt)
+        return detect(user_prompt)
     except LangDetectException:
-        lang = 'es' # Si no puede detectar, usa español por defecto
-
-    # Mapeo de códigos de idioma a locales de Babel
-    locale_map = {
-        'es': 'es_ES',
-        'en': 'en_US',
-        'pt': 'pt_BR',
-        # Puedes añadir más idiomas aquí
-    }
-    locale = locale_map.get(lang, 'es_ES') # Usa español si el idioma no está en el mapa
+        return 'es' # Si no puede detectar, usa español por defecto
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin tildes, sin signos de puntuación y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def _now(tz: str = None) -> datetime:
+    # Sin zona, la hora del servidor; con zona (la del navegador), la del usuario
+    return datetime.now(ZoneInfo(tz)) if tz else datetime.now()
+
+def get_formatted_date(user_prompt: str, lang: str = None, tz: str = None) -> str:
+    """
+    Detecta el idioma del prompt y devuelve la fecha actual formateada en ese idioma.
+    Si ya se conoce el idioma se puede pasar en `lang` y se omite la detección.
+    `tz` es la zona horaria IANA del usuario.
+    """
+    lang = lang or detect_language(user_prompt)
+    locale = LOCALE_MAP.get(lang, 'es_ES') # Usa español si el idioma no está en el mapa
 
-    now = datetime.now()
+    now = _now(tz)
     # 'EEEE' para el día completo, 'd' para el día, 'MMMM' para el mes, 'y' para el año
     formatted_date = format_date(now, format='EEEE, d MMMM y', locale=locale)
 
@@ -35,6 +54,20 @@ def get_formatted_date(user_prompt: str) -> str:
 
     return response_map.get(lang, f"Hoy es {formatted_date}.")
 
+def get_formatted_time(user_prompt: str, lang: str = None, tz: str = None) -> str:
+    """Igual que get_formatted_date, pero con la hora actual."""
+    lang = lang or detect_language(user_prompt)
+    locale = LOCALE_MAP.get(lang, 'es_ES')
+    formatted_time = format_time(_now(tz), format='short', locale=locale)
+
+    response_map = {
+        'es': f"Son las {formatted_time}.",
+        'en': f"It's {formatted_time}.",
+        'pt': f"São {formatted_time}."
+    }
+
+    return response_map.get(lang, f"Son las {formatted_time}.")
+
 def generate_chat_name(first_prompt):
     """Genera un nombre corto para el chat."""
     name = str(first_prompt).split('\n')[0]
@@ -0,0 +1,34 @@
+# vision_helper.py
+import base64
+import time
+
+import hf_transport
+from image_preprocess import para_modelo, analysis_cache
+from metrics import instrumentado, registrar_http
+
+LLAVA_MODEL = "llava-hf/llava-1.6-mistral-7b-hf"
+
+
+@instrumentado()
+def analizar_imagen_con_llava(image_bytes, prompt):
+    # Se envía la imagen reducida al tamaño del modelo, no la foto original
+    prepared = para_modelo(image_bytes, LLAVA_MODEL)
+    cached = analysis_cache.get(prepared.hash, LLAVA_MODEL, prompt)
+    if cached is not None:
+        print("Análisis de imagen reutilizado (misma imagen y prompt)")
+        return cached
+    client = hf_transport.get_inference_client(LLAVA_MODEL)
+    # LLaVA se usa como modelo de chat: la imagen va en el mensaje como data URL
+    imagen = f"data:{prepared.mime};base64," + base64.b64encode(prepared.data).decode("ascii")
+    messages = [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": imagen}},
+        {"type": "text", "text": prompt},
+    ]}]
+    start = time.perf_counter()
+    # Mismos reintentos ante 503 y mismo límite por modelo que el resto de llamadas
+    response = hf_transport.call(LLAVA_MODEL, lambda: client.chat_completion(messages=messages, max_tokens=512))
+    respuesta = response.choices[0].message.content
+    print(f"Análisis de imagen: {len(prepared.data) / 1024:.0f} KB enviados en {time.perf_counter() - start:.2f}s")
+    registrar_http(len(prepared.data), len(str(respuesta).encode("utf-8")))
+    analysis_cache.put(prepared.hash, LLAVA_MODEL, prompt, respuesta)
+    return respuesta